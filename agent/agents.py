@@ -1,13 +1,18 @@
-from .memory_n_agent import MemoryNAgent
-from .ai_agent import AIAgent
+from .memory_n_agent import MemoryNAgent, load_strategy, pack_strategy, save_strategy
 import numpy as np
+import argparse
+import hashlib
 import json
+import os
+import shutil
+
+COMPILED_DIR = 'agent/compiled' # Validated configs with their strategies packed, keyed by a hash of the config
+COMPILE_MIN_MOVES = 4**6        # Configs with fewer strategy moves in total parse quickly and are not cached
 
 
 class Agents():
   def __init__(self, file):
-    data = json.load(file)
-    agent_list = data["agents"]
+    agent_list = load_config(file)
     self.agents = []
     self.tournament = []
     print("Tournament configuration:")
@@ -18,6 +23,8 @@ class Agents():
         for i in range(agent['count']):
           self.tournament.append(MemoryNAgent(agent['name'], agent['id'], agent['n'], agent['strategy']))
       elif agent['type'] == 'ai':
+        # Imports torch, which configs with only memory agents never need
+        from .ai_agent import AIAgent
         # self.agents.append(AIAgent(agent['name'], agent['id'], agent['dimensions'], agent['file']))
         for i in range(agent['count']):
           self.tournament.append(AIAgent(agent['name'], agent['id'], agent['dimensions'], agent['file']))
@@ -28,4 +35,91 @@ class Agents():
 
   def get_random_agent_in_tournament(self):
     agent = np.random.choice(self.tournament)
-    return agent
\ No newline at end of file
+    return agent
+
+def load_config(file):
+  """Validated agent list of a configuration file object, taken from its compiled copy if there is one.
+
+  Large configs are compiled on first use, so later runs memory-map the packed
+  strategies instead of parsing millions of JSON numbers.
+  """
+  text = file.read()
+  path = compiled_path(text)
+  if os.path.isdir(path):
+    with open(os.path.join(path, 'agents.json'), 'r') as handle:
+      return compile_config(json.load(handle), path)
+  agents = compile_config(json.loads(text), os.path.dirname(getattr(file, 'name', '')))
+  if sum(4**agent['n'] for agent in agents if agent['type'] == 'memory') >= COMPILE_MIN_MOVES:
+    save_compiled(agents, path)
+  return agents
+
+def compiled_path(text):
+  return os.path.join(COMPILED_DIR, hashlib.sha256(text.encode('utf-8')).hexdigest()[:16])
+
+def compile_config(data, directory=''):
+  """Checks a parsed configuration and packs the strategies, strategy_file paths are relative to directory"""
+  if not isinstance(data.get('agents'), list):
+    raise ValueError("Agent configuration needs an 'agents' list")
+  agents = []
+  ids = set()
+  for agent in data['agents']:
+    agent = dict(agent)
+    for key in ('name', 'id', 'type', 'count'):
+      if key not in agent:
+        raise ValueError(f"Agent {agent.get('name', '?')} is missing '{key}'")
+    if agent['id'] in ids:
+      raise ValueError(f"Agent {agent['name']} reuses id {agent['id']}, all agent types must have a different ID")
+    ids.add(agent['id'])
+    if agent['type'] == 'memory':
+      if not isinstance(agent.get('n'), int) or agent['n'] < 0:
+        raise ValueError(f"Agent {agent['name']} needs a memory length n >= 0")
+      if ('strategy' in agent) == ('strategy_file' in agent):
+        raise ValueError(f"Agent {agent['name']} needs either a strategy or a strategy_file")
+      if 'strategy_file' in agent:
+        agent['strategy_file'] = os.path.join(directory, agent['strategy_file'])
+        agent['strategy'] = load_strategy(agent['strategy_file'], agent['n'])
+      else:
+        try:
+          agent['strategy'] = pack_strategy(agent['strategy'], agent['n'])
+        except ValueError as e:
+          raise ValueError(f"Agent {agent['name']}: {e}")
+    elif agent['type'] == 'ai':
+      for key in ('dimensions', 'file'):
+        if key not in agent:
+          raise ValueError(f"Agent {agent['name']} is missing '{key}'")
+    else:
+      raise ValueError(f"Agent {agent['name']} has unknown type {agent['type']}")
+    agents.append(agent)
+  return agents
+
+def save_compiled(agents, path):
+  """Writes inline strategies as packed files next to the agent list, atomically replacing path"""
+  tmp = f'{path}.tmp{os.getpid()}'
+  os.makedirs(tmp, exist_ok=True)
+  specs = []
+  for i, agent in enumerate(agents):
+    spec = {k: v for k, v in agent.items() if k != 'strategy'}
+    if agent['type'] == 'memory' and 'strategy_file' not in agent:
+      save_strategy(os.path.join(tmp, f'{i}.npy'), agent['strategy'], agent['n'])
+      spec['strategy_file'] = f'{i}.npy'
+    elif 'strategy_file' in agent:
+      spec['strategy_file'] = os.path.abspath(agent['strategy_file'])
+    specs.append(spec)
+  with open(os.path.join(tmp, 'agents.json'), 'w') as handle:
+    json.dump({'agents': specs}, handle, indent=2)
+  try:
+    os.replace(tmp, path)
+  except OSError:
+    # Another process compiled the same config first
+    shutil.rmtree(tmp, ignore_errors=True)
+  return path
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Validates agent configurations and compiles them for fast loading')
+  parser.add_argument('configs', nargs='+', type=argparse.FileType('r'))
+  args = parser.parse_args()
+  for file in args.configs:
+    text = file.read()
+    agents = compile_config(json.loads(text), os.path.dirname(file.name))
+    print(f"{file.name}: {len(agents)} agent types, compiled to {save_compiled(agents, compiled_path(text))}")
@@ -3,6 +3,7 @@ import sys
 sys.path.append("..") # TODO: Remove this
 from params import *
 from lstm.lstm import LSTM
+from qtable.qtensor import QTensor
 import pickle
 import numpy as np
 import torch.nn.functional as nnf
@@ -23,13 +24,13 @@ class AIAgent(BaseAgent):
 		self.lstm.load(fname)
 		with open(f'qtable/models/{fname}.pickle', 'rb') as handle:
 			self.q_agents = pickle.load(handle)
+		self.q_tensor = QTensor.from_agents(self.q_agents, QTABLE_DEFAULT_ACTION)
 
 	def update(self, opp_move):
 		prev_moves = np.array([self.prev_nn_moves, self.prev_agent_moves]).T
 		pred_id, id_logits = self.lstm.predict_id(self.input)
 		probs = nnf.softmax(id_logits, dim=1).detach().cpu().numpy()
-		# TODO: Implement Linear combination of results here
-		self.val = self.q_agents[pred_id].pick_action(prev_moves, False)
+		self.val = self.q_tensor.pick_action(probs, prev_moves, QTABLE_SELECTION)
 		self.input = self.lstm.rebuild_input(self.val, opp_move, self.input[0])
 		self.prev_agent_moves.append(opp_move)
 		self.prev_nn_moves.append(self.val)
@@ -14,4 +14,11 @@ class BaseAgent:
     return self.val
 
   def reset(self):
-    self.val = 0
\ No newline at end of file
+    self.val = 0
+
+  def get_state(self):
+    """Everything that changes during a game, for checkpoints"""
+    return {'val': self.val}
+
+  def set_state(self, state):
+    self.__dict__.update(state)
\ No newline at end of file
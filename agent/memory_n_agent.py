@@ -1,40 +1,79 @@
 from .base_agent import BaseAgent
+import numpy as np
 
 class MemoryNAgent(BaseAgent):
 
   # (PrevSelfMove PrevOppMove: NextSelfMove)
 
-  # The user defined strategy is a list of 4^n entries. Each entry corresponds 
-  # to a sequence of the agent's previous moves and the opponent's previous 
+  # The user defined strategy is a list of 4^n entries. Each entry corresponds
+  # to a sequence of the agent's previous moves and the opponent's previous
   # moves. For instance, the sequence 00 01 corresponds to the sequence of two
   # cooperations from the agent and a cooperation and defection from the opponent.
   # The index of the list is given by the decimal representation of the sequence.
+  # The strategy is stored bit-packed (see pack_strategy), so instead of the list
+  # it can also be given already packed, e.g. memory-mapped from a strategy file.
   def __init__(self, name, id, n, user_defined_strategy):
     super().__init__(id)
     self.name = name
     self.n = n
-    self.memory = {"agent": [0]*n, "opp": [0]*n}
-    self.strategy = user_defined_strategy
+    self.mask = (1 << n) - 1
+    self.strategy = pack_strategy(user_defined_strategy, n)
+    self._bits = memoryview(self.strategy)
+    self.agent_bits = 0 # Last n own moves, oldest in the highest bit
+    self.opp_bits = 0   # Last n opponent moves, oldest in the highest bit
     self.val = 0
 
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    del state['_bits']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._bits = memoryview(self.strategy)
+
   def update(self, opp_move):
-    self.memory["agent"].append(self.val)
-    self.memory["opp"].append(opp_move)
-    self.memory["agent"].pop(0)
-    self.memory["opp"].pop(0)
-    
-    out = 0
-    for bit in self.memory["agent"]:
-        out = (out << 1) | bit
-    for bit in self.memory["opp"]:
-        out = (out << 1) | bit
-
-    self.val = self.strategy[out]
+    self.agent_bits = ((self.agent_bits << 1) | self.val) & self.mask
+    self.opp_bits = ((self.opp_bits << 1) | opp_move) & self.mask
+    out = (self.agent_bits << self.n) | self.opp_bits
+    self.val = (self._bits[out >> 3] >> (7 - (out & 7))) & 1
 
   def opt(self):
     return 0 if self.val==1 else 1
 
   def reset(self):
-    self.memory["agent"] = [0]*self.n
-    self.memory["opp"] = [0]*self.n
-    self.val = 0
\ No newline at end of file
+    self.agent_bits = 0
+    self.opp_bits = 0
+    self.val = 0
+
+  def get_state(self):
+    return {'val': self.val, 'agent_bits': self.agent_bits, 'opp_bits': self.opp_bits}
+
+def strategy_bytes(n):
+  """Size of a packed memory-n strategy"""
+  return (4**n + 7) // 8
+
+def pack_strategy(strategy, n):
+  """Packs a list of 4^n moves into 8 moves per byte, packed uint8 arrays are returned as they are"""
+  if isinstance(strategy, np.ndarray) and strategy.dtype == np.uint8 and strategy.shape == (strategy_bytes(n),):
+    return strategy
+  strategy = np.asarray(strategy)
+  if strategy.shape != (4**n,):
+    raise ValueError(f"A memory-{n} strategy needs {4**n} moves, got {strategy.size}")
+  if np.any((strategy != 0) & (strategy != 1)):
+    raise ValueError("Strategy moves must be 0 (cooperate) or 1 (defect)")
+  return np.packbits(strategy.astype(np.uint8))
+
+def unpack_strategy(packed, n):
+  return np.unpackbits(packed, count=4**n)
+
+def save_strategy(filename, strategy, n):
+  """Writes a strategy as a packed .npy file that configs can reference with strategy_file"""
+  np.save(filename, pack_strategy(strategy, n))
+
+def load_strategy(filename, n):
+  """Memory-maps a packed strategy file, so large strategies are only paged in as they are used"""
+  packed = np.load(filename, mmap_mode='r')
+  if packed.dtype != np.uint8 or packed.shape != (strategy_bytes(n),):
+    raise ValueError(f"{filename} does not hold a packed memory-{n} strategy ({strategy_bytes(n)} bytes)")
+  return packed
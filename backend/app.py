@@ -1,65 +1,303 @@
-from flask import Flask, request
+from flask import Flask, Response, g, request, stream_with_context
 from flask_cors import CORS
-from models import AIAgent, Tournament
+from models import AIAgent, Tournament, model_fingerprint
+from cache import LRUCache, ResultCache
+from jobs import JobQueue, QueueFull
+from batching import Coalescer
+from metrics import REGISTRY, PHASE_SECONDS, REQUEST_SECONDS, REQUESTS
 import base64
+import json
+import threading
+import time
+import uuid
+
+SESSION_CACHE_SIZE = 1024 # Maximum number of games kept in memory for incremental /play requests
+SESSION_TTL = 30 * 60     # Seconds of inactivity before a session is evicted
+TOURNAMENT_WORKERS = 2    # Tournaments simulated concurrently by the job queue
+TOURNAMENT_QUEUE = 16     # Maximum number of queued or running tournament jobs
+JOB_RETENTION = 10 * 60   # Seconds a finished job's result stays available
+RESULT_CACHE_MEMORY = 64 * 1024 * 1024 # Memory used by cached tournament results
+RESULT_CACHE_DIR = 'saved/tournaments'
+RESULT_CACHE_BYTES = 256 * 1024 * 1024 # Disk space used by cached tournament results
+PLAY_BATCH_WINDOW = 0.005 # Seconds concurrent /play requests wait to share one LSTM forward (0 disables)
+PLAY_MAX_BATCH = 32       # Maximum number of /play requests in one LSTM forward
+PLAY_BATCH_LIMIT = 10000  # Maximum number of histories accepted by /play_batch
+WARMUP = False            # Load the models in the background at startup instead of on the first /play request
 
 app = Flask(__name__)
 CORS(app)
-agent = AIAgent("default")
+_agent = None
+_agent_lock = threading.Lock()
+sessions = LRUCache(SESSION_CACHE_SIZE, SESSION_TTL)
+tournament_jobs = JobQueue(TOURNAMENT_WORKERS, TOURNAMENT_QUEUE, JOB_RETENTION)
+results = ResultCache(RESULT_CACHE_MEMORY, RESULT_CACHE_DIR, RESULT_CACHE_BYTES)
+play_batcher = Coalescer(lambda histories: get_agent().actions(histories), PLAY_BATCH_WINDOW, PLAY_MAX_BATCH) if PLAY_BATCH_WINDOW > 0 else None
+
+REGISTRY.gauge('aipd_sessions', 'Games cached for session mode /play.', fn=lambda: len(sessions))
+REGISTRY.gauge('aipd_tournament_jobs', 'Tournament jobs queued or running.', fn=lambda: tournament_jobs.depth())
+REGISTRY.gauge('aipd_play_batch_queue', 'Requests waiting for the /play coalescer.',
+               fn=lambda: play_batcher.queue.qsize() if play_batcher else 0)
+REGISTRY.gauge('aipd_result_cache_entries', 'Tournament results cached in memory.', fn=lambda: len(results.memory))
+REGISTRY.gauge('aipd_result_cache_bytes', 'Size of the tournament results cached in memory.', fn=lambda: results.memory.bytes)
+for stat in ('memory_hits', 'disk_hits', 'misses'):
+    REGISTRY.counter(f'aipd_result_cache_{stat}_total', f'Tournament result cache {stat.replace("_", " ")}.',
+                     fn=lambda stat=stat: results.stats[stat])
+
+def get_agent():
+    """The served AI agent, loading torch and the models happens on first use so that workers start quickly"""
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                _agent = AIAgent("default")
+    return _agent
+
+def warmup(background=False):
+    """Loads the models ahead of the first request, e.g. from a server's post-fork hook"""
+    if background:
+        threading.Thread(target=get_agent, daemon=True, name='warmup').start()
+    else:
+        get_agent()
+
+if WARMUP:
+    warmup(background=True)
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_SECONDS.observe(time.perf_counter() - g.start, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+
+    return Response(REGISTRY.expose(), mimetype='text/plain; version=0.0.4')
+
+def validate_move(move):
+    # bool is an int subclass and 1.0 == 1, neither may reach the Q-table keys
+    return type(move) == int and move in (0, 1)
 
 def validate_moves(moves):
-    valid_moves = set([0, 1])
     if not isinstance(moves, list):
         return False
-    for move in valid_moves:
-        if move not in valid_moves:
-            return False
-    return True
+    return all(validate_move(move) for move in moves)
+
+def validate_history(user_moves, agent_moves):
+    """Validates a single game history, returning an error response or None"""
+    if not validate_moves(user_moves):
+        return {'message': 'invalid user moves'}, 400
+    if not validate_moves(agent_moves):
+        return {'message': 'invalid agent moves'}, 400
+    if len(user_moves) != len(agent_moves):
+        return {'message': 'user and agent history not the same length'}, 400
+    return None
+
+def validate_histories(histories):
+    """Validates a list of {agent_moves, user_moves} histories, returning an error message or None"""
+    if not isinstance(histories, list):
+        return 'histories must be a list'
+    if len(histories) > PLAY_BATCH_LIMIT:
+        return f'at most {PLAY_BATCH_LIMIT} histories can be evaluated at once'
+    for i, history in enumerate(histories):
+        if not isinstance(history, dict):
+            return f'history {i} is not properly formatted'
+        user_moves = history.get('user_moves')
+        agent_moves = history.get('agent_moves')
+        if not validate_moves(user_moves):
+            return f'invalid user moves in history {i}'
+        if not validate_moves(agent_moves):
+            return f'invalid agent moves in history {i}'
+        if len(user_moves) != len(agent_moves):
+            return f'user and agent history {i} not the same length'
+    return None
 
 
 @app.route('/play', methods=['POST'])
 def get_agent_move():
 
+    if request.json.get('session_id') is not None or request.json.get('session'):
+        return get_session_move()
+
     user_moves = request.json.get('user_moves')
     agent_moves = request.json.get('agent_moves')
 
-    if len(user_moves) == 0 and len(agent_moves) == 0:
+    with PHASE_SECONDS.time(phase='validation'):
+        error = validate_history(user_moves, agent_moves)
+    if error:
+        return error
+
+    if len(user_moves) == 0:
         return {'agent_decision': 0}, 200
 
-    if len(user_moves) != len(agent_moves):
-        return {'message': 'user and agent history not the same length'}, 400
+    if play_batcher:
+        agent_decision = play_batcher.submit((agent_moves, user_moves))
+    else:
+        agent_decision = get_agent().action(agent_moves, user_moves)
 
-    if not validate_moves(user_moves):
-        return {'message': 'invalid user moves'}, 400
+    return {'agent_decision' : agent_decision}, 200
 
-    if not validate_moves(agent_moves):
-        return {'message': 'invalid agent moves'}, 400
+@app.route('/play_batch', methods=['POST'])
+def get_agent_moves():
 
-    agent_decision = agent.action(agent_moves, user_moves)
+    histories = request.json.get('histories')
+    with PHASE_SECONDS.time(phase='validation'):
+        error = validate_histories(histories)
+    if error:
+        return {'message': error}, 400
 
-    return {'agent_decision' : agent_decision}, 200
+    agent_decisions = get_agent().actions([(history['agent_moves'], history['user_moves']) for history in histories])
 
-@app.route('/tournament', methods=['POST'])
-def get_tournament_visual():
+    return {'agent_decisions': agent_decisions}, 200
 
-    generations = request.json.get('generations')
-    interactions = request.json.get('interactions')
-    rounds = request.json.get('rounds')
-    reproduction_rate = request.json.get('reproduction_rate')
-    config = request.json.get('config')
+def get_session_move():
+    """Session mode of /play: only the latest round is sent, the server keeps the rest of the game"""
 
-    if 'agents' not in config:
-        return {'message': 'config is not properly formatted'}, 400
+    session_id = request.json.get('session_id')
+    user_moves = request.json.get('user_moves')
+    agent_moves = request.json.get('agent_moves')
+    session = sessions.get(session_id) if session_id is not None else None
+    latest_round = None
+
+    if session is None:
+        # New session, or one that was evicted: recompute once from the full history if the client sent it
+        if session_id is not None and user_moves is None:
+            return {'message': 'session expired', 'session_expired': True}, 404
+        user_moves = user_moves or []
+        agent_moves = agent_moves or []
+        error = validate_history(user_moves, agent_moves)
+        if error:
+            return error
+        session_id = session_id or uuid.uuid4().hex
+        session = get_agent().start_session(agent_moves, user_moves)
+        sessions.put(session_id, session)
+    elif 'user_move' in request.json or 'agent_move' in request.json:
+        user_move = request.json.get('user_move')
+        agent_move = request.json.get('agent_move')
+        if not validate_move(user_move):
+            return {'message': 'invalid user move'}, 400
+        if not validate_move(agent_move):
+            return {'message': 'invalid agent move'}, 400
+        latest_round = (agent_move, user_move)
+
+    with session.lock:
+        if latest_round is not None:
+            get_agent().advance_session(session, *latest_round)
+        agent_decision = get_agent().session_action(session)
+
+    return {'agent_decision': agent_decision, 'session_id': session_id}, 200
+
+def parse_tournament(payload):
+    """Validates a tournament request, returning the Tournament arguments and an error response"""
+
+    generations = payload.get('generations')
+    interactions = payload.get('interactions')
+    rounds = payload.get('rounds')
+    reproduction_rate = payload.get('reproduction_rate')
+    config = payload.get('config')
+    seed = payload.get('seed', 0)
+
+    if type(config) != dict or 'agents' not in config:
+        return None, ({'message': 'config is not properly formatted'}, 400)
     if type(generations) != int:
-        return {'message': 'generations must be a number'}, 400
+        return None, ({'message': 'generations must be a number'}, 400)
     if type(interactions) != int:
-        return {'message': 'interactions must be a number'}, 400
+        return None, ({'message': 'interactions must be a number'}, 400)
     if type(rounds) != int:
-        return {'message': 'rounds must be a number'}, 400
+        return None, ({'message': 'rounds must be a number'}, 400)
     if type(reproduction_rate) != float or reproduction_rate > 1 or reproduction_rate <= 0:
-        return {'message': 'reproduction rate must be decimal between 0 and 1'}, 400
+        return None, ({'message': 'reproduction rate must be decimal between 0 and 1'}, 400)
+    if type(seed) != int:
+        return None, ({'message': 'seed must be a number'}, 400)
+
+    return (generations, interactions, rounds, reproduction_rate, config, seed), None
+
+def run_tournament(args, cancelled=None):
+    """Returns the cached result for identical arguments and models, otherwise simulates and caches it"""
+    # The AI agents load the saved models, results computed with older models must not be served
+    key = ResultCache.key({'args': args, 'models': model_fingerprint('default')})
+    result = results.get(key)
+    if result is not None:
+        return result
+    tournament = Tournament(*args)
+    buffer = tournament.tournament(cancelled)
+    if buffer is None:
+        return None
+    with PHASE_SECONDS.time(phase='result_cache'):
+        return results.put(key, buffer.getvalue(), tournament.summary())
+
+@app.route('/tournament', methods=['POST'])
+def get_tournament_visual():
+
+    with PHASE_SECONDS.time(phase='validation'):
+        args, error = parse_tournament(request.json)
+    if error:
+        return error
+
+    return run_tournament(args), 200
+
+@app.route('/tournament/stream', methods=['POST'])
+def stream_tournament():
+    """Streams every generation as a server-sent event as soon as it has been simulated"""
+
+    args, error = parse_tournament(request.json)
+    if error:
+        return error
+    frames = request.json.get('frames', True)
+    if type(frames) != bool:
+        return {'message': 'frames must be true or false'}, 400
+
+    tournament = Tournament(*args)
+
+    def events():
+        for idx, generation in enumerate(tournament.iter_generations()):
+            data = {'generation': idx, 'population': tournament.count_population(generation)}
+            if frames:
+                buffer = tournament.render_generation(generation, idx, tournament.unique_agents)
+                data['frame'] = base64.b64encode(buffer.getbuffer()).decode("ascii")
+            yield f'event: generation\ndata: {json.dumps(data)}\n\n'
+        yield 'event: done\ndata: {}\n\n'
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/tournament/cache', methods=['GET'])
+def get_tournament_cache_stats():
+
+    return results.info(), 200
+
+@app.route('/tournament/jobs', methods=['POST'])
+def submit_tournament():
+
+    args, error = parse_tournament(request.json)
+    if error:
+        return error
+
+    try:
+        job = tournament_jobs.submit(run_tournament, args)
+    except QueueFull:
+        return {'message': 'too many tournaments queued, try again later'}, 503
+
+    return job.to_dict(), 202
+
+@app.route('/tournament/jobs/<job_id>', methods=['GET'])
+def get_tournament_job(job_id):
+
+    job = tournament_jobs.get(job_id)
+    if job is None:
+        return {'message': 'unknown job'}, 404
+
+    return job.to_dict(), 200
+
+@app.route('/tournament/jobs/<job_id>', methods=['DELETE'])
+def cancel_tournament_job(job_id):
+
+    job = tournament_jobs.cancel(job_id)
+    if job is None:
+        return {'message': 'unknown job'}, 404
 
-    tournament = Tournament(generations, interactions, rounds, reproduction_rate, config)
-    buffer = tournament.tournament()
-    gif_base64 = base64.b64encode(buffer.getbuffer()).decode("ascii")
-    return {'gif': gif_base64}, 200
\ No newline at end of file
+    return job.to_dict(), 200
@@ -0,0 +1,51 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class Coalescer:
+    """Merges concurrent calls into batches.
+
+    Callers block in submit while a single dispatcher thread collects items for
+    up to `window` seconds or until max_batch items are waiting, runs
+    fn(items) once and hands every caller its own entry of the returned list.
+    """
+
+    def __init__(self, fn, window, max_batch):
+        self.fn = fn
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._dispatch, daemon=True, name='coalescer')
+        self.thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self.queue.put((item, future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.fn([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
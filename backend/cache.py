@@ -0,0 +1,165 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and/or total size in bytes, with an optional time-to-live per entry"""
+
+    def __init__(self, max_size=None, ttl=None, max_bytes=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires, _ = entry
+            if expires is not None and expires < time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, size=0):
+        """Caches value, size is its size in bytes and only counts towards max_bytes"""
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (value, expires, size)
+            self.bytes += size
+            # An entry larger than max_bytes evicts everything, itself included
+            while self.entries and ((self.max_size is not None and len(self.entries) > self.max_size) or
+                                    (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                self._remove(next(iter(self.entries)))
+
+    def pop(self, key):
+        with self.lock:
+            entry = self._remove(key)
+        return None if entry is None else entry[0]
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+        return entry
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ResultCache:
+    """Two-tier cache for tournament results keyed by a content hash.
+
+    The memory tier is an LRUCache of response dicts bounded by the size of
+    their encoded GIFs and summaries. The disk tier stores the raw GIF bytes and
+    the summary as files named by the key. Both tiers are bounded by total size
+    and evict the least recently used entries first.
+    """
+
+    def __init__(self, memory_bytes, directory, disk_bytes):
+        self.memory = LRUCache(max_bytes=memory_bytes)
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self.lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(payload):
+        """Canonical hash of a request: key order and whitespace do not matter"""
+        canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        result = self.memory.get(key)
+        if result is not None:
+            self._count('memory_hits')
+            return result
+        result = self._read(key)
+        if result is not None:
+            self._remember(key, result)
+            self._count('disk_hits')
+            return result
+        self._count('misses')
+        return None
+
+    def put(self, key, gif, summary):
+        result = {'gif': base64.b64encode(gif).decode('ascii'), 'summary': summary}
+        self._remember(key, result)
+        self._write(key, gif, summary)
+        return result
+
+    def info(self):
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = sum(stats.values())
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        stats['memory_entries'] = len(self.memory)
+        stats['memory_bytes'] = self.memory.bytes
+        return stats
+
+    def _remember(self, key, result):
+        self.memory.put(key, result, len(result['gif']) + len(json.dumps(result['summary'])))
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, f'{key}.{ext}')
+
+    def _read(self, key):
+        try:
+            with open(self._path(key, 'gif'), 'rb') as handle:
+                gif = handle.read()
+            with open(self._path(key, 'json'), 'r') as handle:
+                summary = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(self._path(key, 'gif'))
+        except OSError:
+            pass
+        return {'gif': base64.b64encode(gif).decode('ascii'), 'summary': summary}
+
+    def _write(self, key, gif, summary):
+        # Write to temporary files first so concurrent readers never see partial entries
+        tmp = f'.{threading.get_ident()}.tmp'
+        with open(self._path(key, 'json') + tmp, 'w') as handle:
+            json.dump(summary, handle)
+        with open(self._path(key, 'gif') + tmp, 'wb') as handle:
+            handle.write(gif)
+        os.replace(self._path(key, 'json') + tmp, self._path(key, 'json'))
+        os.replace(self._path(key, 'gif') + tmp, self._path(key, 'gif'))
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.gif'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-len('.gif')]))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            for ext in ('gif', 'json'):
+                try:
+                    os.remove(self._path(key, ext))
+                except OSError:
+                    pass
+            total -= size
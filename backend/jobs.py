@@ -0,0 +1,112 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.future = None
+        self.cancelled = threading.Event()
+        self.finished_at = None
+
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def to_dict(self):
+        out = {'job_id': self.id, 'status': self.status}
+        if self.status == DONE:
+            out.update(self.result)
+        elif self.status == FAILED:
+            out['message'] = self.error
+        return out
+
+
+class JobQueue:
+    """Runs jobs on a bounded local thread pool.
+
+    At most max_pending jobs may be queued or running at once. Job functions
+    receive a threading.Event as their last argument and are expected to stop
+    early once it is set. Finished jobs are kept for `retention` seconds so
+    clients can fetch their results.
+    """
+
+    def __init__(self, workers, max_pending, retention):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self.max_pending = max_pending
+        self.retention = retention
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        job = Job()
+        with self.lock:
+            self._prune()
+            if self._depth() >= self.max_pending:
+                raise QueueFull()
+            self.jobs[job.id] = job
+            job.future = self.executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.finished():
+            return job
+        job.cancelled.set()
+        if job.future.cancel():
+            self._finish(job, CANCELLED)
+        return job
+
+    def depth(self):
+        """Number of jobs that are queued or running"""
+        with self.lock:
+            return self._depth()
+
+    def _run(self, job, fn, args):
+        if job.cancelled.is_set():
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        try:
+            result = fn(*args, job.cancelled)
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, FAILED)
+            return
+        if job.cancelled.is_set():
+            self._finish(job, CANCELLED)
+        else:
+            job.result = result
+            self._finish(job, DONE)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.monotonic()
+
+    def _depth(self):
+        return sum(1 for job in self.jobs.values() if not job.finished())
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.retention
+        expired = [job_id for job_id, job in self.jobs.items() if job.finished() and job.finished_at < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
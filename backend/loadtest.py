@@ -0,0 +1,200 @@
+"""Load test for the backend.
+
+Drives /play with game lengths drawn from a geometric distribution and
+/tournament with configurable population sizes, either in-process through
+Flask's test client or against a running server given with --url. Reports
+throughput, latency percentiles and memory and writes them as JSON so that
+runs can be compared across commits:
+
+    python loadtest.py play --requests 2000 --concurrency 16 --out play.json
+    python loadtest.py tournament --requests 20 --population 40 --out tournament.json
+    python loadtest.py play --compare play.json
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+class InProcessClient:
+    """Sends requests through Flask's test client, one client per thread"""
+
+    def __init__(self):
+        from app import app
+        self.app = app
+        self.local = threading.local()
+
+    def post(self, path, payload):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        start = time.perf_counter()
+        response = self.local.client.post(path, json=payload)
+        return response.status_code, response.get_json(), time.perf_counter() - start
+
+
+class HTTPClient:
+    """Sends requests to a server that is already running locally"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def post(self, path, payload):
+        request = urllib.request.Request(self.url + path, data=json.dumps(payload).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read()), time.perf_counter() - start
+        except urllib.error.HTTPError as e:
+            return e.code, None, time.perf_counter() - start
+
+
+def game_length(rng, mean, max_length):
+    """Game lengths follow a geometric distribution: every round ends the game with probability 1/mean"""
+    return min(int(rng.geometric(1 / mean)), max_length)
+
+def random_moves(rng, length):
+    return rng.integers(0, 2, length).tolist()
+
+def play_requests(args, rng, count):
+    """One callable per request; session mode plays whole games, one request per round"""
+    calls = []
+    if args.mode == 'full':
+        for _ in range(count):
+            length = game_length(rng, args.mean_length, args.max_length)
+            payload = {'user_moves': random_moves(rng, length), 'agent_moves': random_moves(rng, length)}
+            calls.append(lambda client, payload=payload: [client.post('/play', payload)])
+    else:
+        while len(calls) < count:
+            length = game_length(rng, args.mean_length, args.max_length)
+            calls.append(lambda client, user_moves=random_moves(rng, length): play_session(client, user_moves))
+    return calls
+
+def play_session(client, user_moves):
+    response = client.post('/play', {'session': True})
+    responses = [response]
+    for user_move in user_moves:
+        status, body, _ = response
+        if status != 200:
+            break
+        payload = {'session_id': body['session_id'], 'user_move': user_move, 'agent_move': body['agent_decision']}
+        response = client.post('/play', payload)
+        responses.append(response)
+    return responses
+
+def tournament_requests(args, rng, count):
+    types = [
+        ("Cooperate", [0, 0, 0, 0]),
+        ("Defect", [1, 1, 1, 1]),
+        ("Copy", [0, 1, 0, 1]),
+        ("Grudge", [0, 1, 1, 1]),
+    ]
+    calls = []
+    for _ in range(count):
+        counts = rng.multinomial(args.population, [1 / len(types)] * len(types))
+        config = {'agents': [{'name': name, 'id': i, 'type': 'memory', 'count': int(count), 'n': 1, 'strategy': strategy}
+                             for i, ((name, strategy), count) in enumerate(zip(types, counts))]}
+        payload = {'generations': args.generations, 'interactions': args.interactions, 'rounds': args.rounds,
+                   'reproduction_rate': 0.5, 'config': config, 'seed': int(rng.integers(1 << 30))}
+        calls.append(lambda client, payload=payload: [client.post('/tournament', payload)])
+    return calls
+
+def run(client, calls, concurrency):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def issue(call):
+        responses = call(client)
+        with lock:
+            latencies.extend(elapsed for _, _, elapsed in responses)
+            errors[0] += sum(1 for status, _, _ in responses if status != 200)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(issue, calls))
+    return time.perf_counter() - start, np.array(latencies), errors[0]
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def report(args, wall, latencies, errors, rss_before):
+    return {
+        'endpoint': args.endpoint,
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'settings': {k: v for k, v in vars(args).items() if k not in ('out', 'compare')},
+        'requests': len(latencies),
+        'errors': errors,
+        'wall_seconds': wall,
+        'throughput': len(latencies) / wall,
+        'latency_ms': {
+            'mean': float(np.mean(latencies) * 1000),
+            'p50': float(np.percentile(latencies, 50) * 1000),
+            'p95': float(np.percentile(latencies, 95) * 1000),
+            'p99': float(np.percentile(latencies, 99) * 1000),
+            'max': float(np.max(latencies) * 1000),
+        },
+        # Only meaningful in-process, a remote server's memory is not visible here
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if args.url is None else None,
+        'rss_growth_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024 if args.url is None else None,
+    }
+
+def compare(current, baseline):
+    print(f"Compared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    rows = [('throughput', current['throughput'], baseline['throughput'])]
+    rows += [(f'{k} ms', current['latency_ms'][k], baseline['latency_ms'][k]) for k in ('p50', 'p95', 'p99')]
+    for name, now, then in rows:
+        change = (now - then) / then * 100 if then else float('nan')
+        print(f"\t{name:>10}: {then:10.2f} -> {now:10.2f} ({change:+.1f}%)")
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    random.seed(args.seed)
+    client = HTTPClient(args.url) if args.url else InProcessClient()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Warmup requests are distinct from the measured ones so they cannot warm up the result cache
+    make_requests = play_requests if args.endpoint == 'play' else tournament_requests
+    calls = make_requests(args, rng, args.warmup + args.requests)
+    if args.warmup:
+        run(client, calls[:args.warmup], args.concurrency)
+    wall, latencies, errors = run(client, calls[args.warmup:], args.concurrency)
+    results = report(args, wall, latencies, errors, rss_before)
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, 'w') as handle:
+            json.dump(results, handle, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as handle:
+            compare(results, json.load(handle))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('endpoint', choices=['play', 'tournament'])
+    parser.add_argument('--url', help='Base URL of a running server (default: in-process test client)')
+    parser.add_argument('--requests', type=int, default=1000, help='Number of requests (games in session mode)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('--warmup', type=int, default=20, help='Requests sent before measuring')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', choices=['full', 'session'], default='full', help='Full history or session mode /play')
+    parser.add_argument('--mean-length', type=float, default=20, help='Mean game length for /play')
+    parser.add_argument('--max-length', type=int, default=200, help='Longest game sent to /play')
+    parser.add_argument('--population', type=int, default=20, help='Tournament population size')
+    parser.add_argument('--generations', type=int, default=10)
+    parser.add_argument('--interactions', type=int, default=2)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--out', help='File to write the results to as JSON')
+    parser.add_argument('--compare', help='Results file of an earlier run to compare against')
+    main(parser.parse_args())
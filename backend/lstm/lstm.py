@@ -23,6 +23,23 @@ class LSTM(nn.Module):
         pred_id = id_logits.argmax(dim=-1)
         return pred_id.item(), id_logits
 
+    def predict_ids(self, inputs):
+        """Predicts ids for a list of (length, IN) histories of different lengths in one forward pass"""
+        with torch.no_grad():
+            packed = nn.utils.rnn.pack_sequence(inputs, enforce_sorted=False)
+            _, (h, _) = self.lstm(packed)
+            id_logits = self.id_fc(self.relu(h[-1]))
+        pred_ids = id_logits.argmax(dim=-1)
+        return pred_ids.tolist(), id_logits
+
+    def step(self, input, state=None):
+        """Advances the LSTM over input starting from a previous (h, c) state instead of the whole history"""
+        with torch.no_grad():
+            out, state = self.lstm(input, state)
+            id_logits = self.id_fc(self.relu(out[:, -1, :]))
+        pred_id = id_logits.argmax(dim=-1)
+        return pred_id.item(), id_logits, state
+
     def load(self, fname):
         state_dict = torch.load(f"saved/{fname}.pth", map_location=torch.device('cpu'))
         self.load_state_dict(state_dict)
@@ -1,14 +1,15 @@
 import io
+import os
 import random
 import pickle
 import math
-import torch
-import torch.nn as nn
-import torch.nn.functional as nnf
+import threading
+from collections import deque
 import numpy as np
-from matplotlib.figure import Figure
-from PIL import Image
-from lstm.lstm import LSTM
+from qtable.qtensor import QTensor
+import shared
+from metrics import BATCH_SIZE, MODEL_LOAD_SECONDS, PHASE_SECONDS
+import time
 
 LSTM_HIDDEN = 200
 LSTM_LAYERS = 4
@@ -16,11 +17,29 @@ IN = 2
 OUT = 2
 NUM_AGENTS = 4
 DEVICE = 'cpu'
+SHARED_MODELS = False # Map models from saved/<name>.shared instead of loading private copies (see shared.py)
+QTABLE_SELECTION = 'weighted' # Blend the Q-tables by predicted agent probability ('weighted') or use the most likely one ('argmax')
+DEFAULT_ACTION = 0 # Served for ties and histories the Q-tables have never seen, None picks randomly
 REWARD = [[2, 2], # Coop, Coop
           [0, 3], # Coop, Dfct
           [3, 0], # Dfct, Coop
           [1, 1]] # Dfct, Dfct
 
+def model_fingerprint(fname):
+    """Identifies the files AIAgent(fname) loads and the settings it serves them with, it changes when they are retrained or re-exported"""
+    if SHARED_MODELS:
+        paths = sorted(os.path.join(root, file) for root, _, files in os.walk(shared.shared_path(fname)) for file in files)
+    else:
+        paths = [f'saved/{fname}.pth', f'saved/{fname}.pickle']
+    files = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            files.append([path, stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            files.append([path, None, None])
+    return {'files': files, 'selection': QTABLE_SELECTION, 'default_action': DEFAULT_ACTION}
+
 class BaseAgent:
 
   def __init__(self, i=-1):
@@ -42,32 +61,107 @@ class BaseAgent:
 class AIAgent(BaseAgent):
     
     def __init__(self, load_fname):
+        # torch is only imported once a model is loaded, so workers start without it
+        from lstm.lstm import LSTM
         self.lstm = LSTM(IN, LSTM_HIDDEN, OUT, NUM_AGENTS, LSTM_LAYERS, DEVICE)
         self.load(load_fname)
         self.reset()
         
     def load(self, fname):
+        start = time.perf_counter()
+        if SHARED_MODELS:
+            self.load_shared(fname)
+        else:
+            self.load_private(fname)
+        MODEL_LOAD_SECONDS.set(time.perf_counter() - start)
+
+    def load_private(self, fname):
         print(f"Loading Models from file: {fname}")
         self.lstm.load(fname)
         with open(f'saved/{fname}.pickle', 'rb') as handle:
-            self.q_agents = pickle.load(handle)
-        for i in range(NUM_AGENTS):
-            self.q_agents[i].set_epsilon(-1)
+            self.q_tensor = QTensor.from_agents(pickle.load(handle), DEFAULT_ACTION)
+
+    def load_shared(self, fname):
+        """Maps the exported weights and Q-tables read-only so that they are shared between processes"""
+        print(f"Mapping shared Models from: {shared.shared_path(fname)}")
+        self.lstm.load_state_dict(shared.load_state_dict(fname), assign=True)
+        self.q_tensor = shared.load_qtensor(fname, DEFAULT_ACTION)
 
     def action(self, agent_moves, opponent_moves):
-        combined_moves = np.vstack([agent_moves, opponent_moves]).T
-        input = torch.Tensor(combined_moves).type(torch.FloatTensor).to('cpu').unsqueeze(0)
-        pred_id, _ = self.lstm.predict_id(input) 
-        q_agent = self.q_agents[pred_id]
-        action = q_agent.pick_action(combined_moves, False)
-        return action
+        import torch
+        with PHASE_SECONDS.time(phase='tensor'):
+            combined_moves = np.vstack([agent_moves, opponent_moves]).T
+            input = torch.Tensor(combined_moves).type(torch.FloatTensor).to('cpu').unsqueeze(0)
+        with PHASE_SECONDS.time(phase='lstm'):
+            _, id_logits = self.lstm.predict_id(input) 
+            probs = id_logits.softmax(dim=1).detach().cpu().numpy()
+        BATCH_SIZE.observe(1)
+        with PHASE_SECONDS.time(phase='q_lookup'):
+            return self.q_tensor.pick_action(probs, combined_moves, QTABLE_SELECTION)
+
+    def actions(self, histories, max_batch=256):
+        """Batched action for a list of (agent_moves, opponent_moves) histories.
+
+        Histories of any mix of lengths run as one packed LSTM forward per
+        max_batch histories, and all actions are then picked in one Q-tensor lookup.
+        """
+        import torch
+        decisions = [0] * len(histories)
+        with PHASE_SECONDS.time(phase='tensor'):
+            combined = [np.vstack([agent_moves, opponent_moves]).T for agent_moves, opponent_moves in histories]
+            # Sorting by length keeps similar lengths in one chunk, which packs with the fewest wasted steps
+            played = sorted((i for i, moves in enumerate(combined) if len(moves) > 0), key=lambda i: len(combined[i]))
+
+        probs = []
+        for start in range(0, len(played), max_batch):
+            chunk = played[start:start + max_batch]
+            inputs = [torch.Tensor(combined[i]).type(torch.FloatTensor) for i in chunk]
+            with PHASE_SECONDS.time(phase='lstm'):
+                _, id_logits = self.lstm.predict_ids(inputs)
+                probs.append(id_logits.softmax(dim=1).cpu().numpy())
+            BATCH_SIZE.observe(len(chunk))
+
+        if played:
+            with PHASE_SECONDS.time(phase='q_lookup'):
+                actions = self.q_tensor.pick_actions(np.concatenate(probs), [combined[i] for i in played], QTABLE_SELECTION)
+            for i, action in zip(played, actions):
+                decisions[i] = action
+        return decisions
+
+    def start_session(self, agent_moves=(), opponent_moves=()):
+        """Creates a game session, replaying any existing history once to recover the LSTM state"""
+        import torch
+        session = GameSession(self.q_tensor.memory)
+        if len(agent_moves) > 0:
+            combined_moves = np.vstack([agent_moves, opponent_moves]).T
+            input = torch.Tensor(combined_moves).type(torch.FloatTensor).to('cpu').unsqueeze(0)
+            _, id_logits, session.state = self.lstm.step(input)
+            session.probs = id_logits.softmax(dim=1).cpu().numpy()
+            session.rounds.extend(zip(agent_moves, opponent_moves))
+        return session
+
+    def session_action(self, session):
+        """Picks an action from the cached session state without rerunning the LSTM"""
+        if len(session.rounds) == 0:
+            return 0
+        with PHASE_SECONDS.time(phase='q_lookup'):
+            combined_moves = np.array(session.rounds)
+            return self.q_tensor.pick_action(session.probs, combined_moves, QTABLE_SELECTION)
+
+    def advance_session(self, session, agent_move, opponent_move):
+        """Feeds only the latest round through the LSTM, continuing from the cached (h, c) state"""
+        import torch
+        input = torch.Tensor([[[agent_move, opponent_move]]]).to('cpu')
+        with PHASE_SECONDS.time(phase='lstm'):
+            _, id_logits, session.state = self.lstm.step(input, session.state)
+            session.probs = id_logits.softmax(dim=1).cpu().numpy()
+        session.rounds.append((agent_move, opponent_move))
 
     def update(self, opp_move):
         prev_moves = np.array([self.prev_nn_moves, self.prev_agent_moves]).T
         pred_id, id_logits = self.lstm.predict_id(self.input)
-        probs = nnf.softmax(id_logits, dim=1).detach().cpu().numpy()
-        # TODO: Implement Linear combination of results here
-        self.val = self.q_agents[pred_id].pick_action(prev_moves, False)
+        probs = id_logits.softmax(dim=1).detach().cpu().numpy()
+        self.val = self.q_tensor.pick_action(probs, prev_moves, QTABLE_SELECTION)
         self.input = self.lstm.rebuild_input(self.val, opp_move, self.input[0])
         self.prev_agent_moves.append(opp_move)
         self.prev_nn_moves.append(self.val)
@@ -80,6 +174,17 @@ class AIAgent(BaseAgent):
         self.input = self.lstm.build_input_vector(prev_agent_choice)
         self.val=0
 
+class GameSession:
+    """Per-user game state kept between /play requests"""
+
+    def __init__(self, memory):
+        self.state = None
+        self.probs = None
+        # The Q-tables only look at the last memory rounds, older ones are dropped
+        # so that a request costs the same however long the game has run
+        self.rounds = deque(maxlen=memory)
+        self.lock = threading.Lock()
+
 class MemoryNAgent(BaseAgent):
 
   def __init__(self, name, id, n, user_defined_strategy):
@@ -131,13 +236,16 @@ class AgentWrapper:
 
 class Tournament:
 
-    def __init__(self, generations, interactions, rounds, reproduction_rate, config):
+    def __init__(self, generations, interactions, rounds, reproduction_rate, config, seed=None):
+        self.random = random.Random(seed)
         self.interactions = interactions
         self.generations = generations
         self.rounds = rounds
         self.reproduction_rate = reproduction_rate
         self.unique_agents = len(config['agents'])
         self.agents = self.create_agents(config)
+        self.names = {agent_cfg['id']: agent_cfg['name'] for agent_cfg in config['agents']}
+        self.populations = []
 
     def create_agents(self, config):
         agents = []
@@ -193,44 +301,64 @@ class Tournament:
             agents_pre_selection[i] = agents_pre_selection[-i]
         return agents_pre_selection
 
+    def render_generation(self, generation, idx, agent_length):
+        """Renders the population of one generation into a PNG buffer"""
+        from matplotlib.figure import Figure
+        fig = Figure(figsize=(5,5))
+        ax = fig.add_subplot(1, 1, 1)
+        ax.axis('off')
+        buffer = io.BytesIO()
+        side = int(np.ceil(np.sqrt(len(generation))))
+        img = np.full((side*side, 1), agent_length+1)
+        for i, tournament_agent in enumerate(generation):
+            img[i] = tournament_agent.id()
+        img = img.reshape((side, side)).astype(np.uint8)
+        im = ax.imshow(img, cmap='gist_ncar', vmin=0, vmax=agent_length)
+        ax.set_title("Generation %d" % idx)
+        fig.suptitle("Population Evolution in a Tournament Setting")
+        fig.colorbar(im, ax=ax, location='right', shrink=0.7)
+        fig.savefig(buffer, format='png')
+        return buffer
+
     def animate_tournament(self, generations, agent_length):
-        image_buffers = []
-        for idx, generation in enumerate(generations):
-            fig = Figure(figsize=(5,5))
-            ax = fig.add_subplot(1, 1, 1)
-            ax.axis('off')
-            buffer = io.BytesIO()
-            side = int(np.ceil(np.sqrt(len(generation))))
-            img = np.full((side*side, 1), agent_length+1)
-            for i, tournament_agent in enumerate(generation):
-                img[i] = tournament_agent.id()
-            img = img.reshape((side, side)).astype(np.uint8)
-            im = ax.imshow(img, cmap='gist_ncar', vmin=0, vmax=agent_length)
-            ax.set_title("Generation %d" % idx)
-            fig.suptitle("Population Evolution in a Tournament Setting")
-            fig.colorbar(im, ax=ax, location='right', shrink=0.7)
-            fig.savefig(buffer, format='png')
-            image_buffers.append(buffer)
-        images = [Image.open(buffer) for buffer in image_buffers]
+        from PIL import Image
+        rendering = 0
+
+        # Frames are rendered lazily while the GIF encoder consumes them, so the
+        # encoding time is the time of the whole save minus the rendering
+        def frames():
+            nonlocal rendering
+            for idx, generation in enumerate(generations):
+                start = time.perf_counter()
+                buffer = self.render_generation(generation, idx, agent_length)
+                rendering += time.perf_counter() - start
+                yield Image.open(buffer)
+
+        images = frames()
         gif_buffer = io.BytesIO()
-        images[0].save(gif_buffer, 
+        start = time.perf_counter()
+        next(images).save(gif_buffer, 
                        format="GIF", 
                        save_all=True, 
-                       append_images=images[1:],
+                       append_images=images,
                        optimize=False, 
                        loop=0, 
-                       duration=len(images)*20)
+                       duration=len(generations)*20)
+        PHASE_SECONDS.observe(rendering, phase='rendering')
+        PHASE_SECONDS.observe(time.perf_counter() - start - rendering, phase='gif_encoding')
         return gif_buffer
 
-    def tournament(self):
-        generations = []
-        generations.append(self.agents)
+    def iter_generations(self, cancelled=None):
+        """Yields the population of every generation as soon as it has been simulated"""
+        yield self.agents
         for generation in range(self.generations):
+            if cancelled is not None and cancelled.is_set():
+                return
             tournament_agents = self.agents
             rewards = [0] * len(tournament_agents)
             agents_and_rewards = [list(a_r) for a_r in zip(tournament_agents, rewards)]
             for interaction in range(self.interactions):
-                random.shuffle(agents_and_rewards)
+                self.random.shuffle(agents_and_rewards)
                 for i in range(0, len(agents_and_rewards) - 1, 2):
                     agent0 = agents_and_rewards[i][0]
                     agent1 = agents_and_rewards[i+1][0]
@@ -242,10 +370,30 @@ class Tournament:
             agents_and_rewards.sort(key=lambda x: x[1])
             agents_pre_selection = [list(a_r) for a_r in zip(*agents_and_rewards)][0]
             agents_post_selection = self.natural_selection(agents_pre_selection)
-            generations.append(agents_post_selection)
             self.agents = agents_post_selection
+            yield agents_post_selection
+
+    def tournament(self, cancelled=None):
+        """Runs the tournament and returns the animation, or None if cancelled was set before it finished"""
+        with PHASE_SECONDS.time(phase='simulation'):
+            generations = list(self.iter_generations(cancelled))
+        if len(generations) <= self.generations:
+            return None
+        self.populations = [self.count_population(generation) for generation in generations]
         return self.animate_tournament(generations, self.unique_agents)
 
+    def count_population(self, generation):
+        counts = {name: 0 for name in self.names.values()}
+        for agent in generation:
+            counts[self.names[agent.id()]] += 1
+        return counts
+
+    def summary(self):
+        """Population of every agent type per generation of the last run"""
+        return {
+            'population': {name: [counts[name] for counts in self.populations] for name in self.names.values()},
+        }
+
 
 if __name__ == "__main__":
 
@@ -0,0 +1,116 @@
+import os
+import random
+import numpy as np
+
+class QTensor:
+  """Read-only Q-tables of several agents stacked into flat arrays.
+
+  states is a sorted array of fixed width byte strings shared by every table
+  and values holds the Q-values as a (num_ids, num_states, 2) array. Lookups
+  use a binary search, so no Python objects are created per state and the
+  arrays can be memory-mapped and shared between processes. Actions are
+  picked from the Q-values of every table weighted by the predicted
+  probability of each opponent type ('weighted'), or from the table of the
+  most likely type only ('argmax').
+
+  The tensor never changes after it is built, so one instance can be shared
+  by any number of threads. Ties and states no table has seen get
+  default_action, or a random action if it is None.
+  """
+
+  def __init__(self, states, values, memory=1000, default_action=None):
+    self.states = states
+    self.values = values
+    self.memory = memory
+    self.default_action = default_action
+
+  @classmethod
+  def from_agents(cls, q_agents, default_action=None):
+    """Stacks a dict of QAgents keyed by id 0..n-1 into one tensor"""
+    ids = sorted(q_agents)
+    states = sorted(set().union(*(q_agents[i].get_table() for i in ids)))
+    index = {state: row for row, state in enumerate(states)}
+    values = np.zeros((len(ids), len(states), 2))
+    for i in ids:
+      for state, q in q_agents[i].get_table().items():
+        values[i, index[state]] = q
+    encoded = np.array([state.encode('utf-8') for state in states], dtype=bytes)
+    values.setflags(write=False)
+    encoded.setflags(write=False)
+    return cls(encoded, values, q_agents[ids[0]].memory, default_action)
+
+  def save(self, path):
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'states.npy'), self.states)
+    np.save(os.path.join(path, 'values.npy'), self.values)
+    np.save(os.path.join(path, 'memory.npy'), np.array(self.memory))
+
+  @classmethod
+  def load(cls, path, mmap_mode='r', default_action=None):
+    states = np.load(os.path.join(path, 'states.npy'), mmap_mode=mmap_mode)
+    values = np.load(os.path.join(path, 'values.npy'), mmap_mode=mmap_mode)
+    memory = int(np.load(os.path.join(path, 'memory.npy')))
+    return cls(states, values, memory, default_action)
+
+  def key(self, state):
+    if len(state) > self.memory:
+      state = state[-self.memory:, :]
+    return str(state).encode('utf-8')
+
+  def lookups(self, states):
+    """Rows of the states in the shared index, -1 where no table has seen the state"""
+    if len(self.states) == 0:
+      return np.full(len(states), -1)
+    keys = np.array([self.key(state) for state in states], dtype=bytes)
+    rows = np.minimum(np.searchsorted(self.states, keys), len(self.states) - 1)
+    return np.where(self.states[rows] == keys, rows, -1)
+
+  def expected_q(self, probs, rows):
+    """Q-values weighted by the probability of every table, (B, num_ids) and (B,) rows -> (B, 2)"""
+    q = self.values[:, np.maximum(rows, 0), :]
+    q = np.where((rows >= 0)[np.newaxis, :, np.newaxis], q, 0)
+    return np.einsum('bi,iba->ba', probs, q)
+
+  def pick_actions(self, probs, states, mode='weighted'):
+    """Greedy actions for a batch of states given the (B, num_ids) opponent type probabilities"""
+    probs = np.asarray(probs, dtype=np.float64).reshape(len(states), -1)
+    if mode == 'argmax':
+      probs = np.eye(probs.shape[1])[probs.argmax(axis=1)]
+    elif mode != 'weighted':
+      raise ValueError(f"Unknown selection mode: {mode}")
+    q = self.expected_q(probs, self.lookups(states))
+    actions = (q[:, 1] > q[:, 0]).astype(int)
+    ties = np.flatnonzero(np.isclose(q[:, 0], q[:, 1], rtol=0, atol=1e-5))
+    for i in ties:
+      actions[i] = self.undecided_action()
+    return actions.tolist()
+
+  def lookup(self, state):
+    """Row of a state in the shared index, or -1 if no table has seen it"""
+    key = self.key(state)
+    row = np.searchsorted(self.states, key)
+    if row < len(self.states) and self.states[row] == key:
+      return int(row)
+    return -1
+
+  def pick_action(self, probs, state, mode='weighted'):
+    """pick_actions for a single state, without the batch overhead"""
+    probs = np.ravel(probs)
+    row = self.lookup(state)
+    if row < 0:
+      return self.undecided_action()
+    if mode == 'argmax':
+      q1, q2 = self.values[probs.argmax(), row]
+    elif mode == 'weighted':
+      q1, q2 = probs @ self.values[:, row, :]
+    else:
+      raise ValueError(f"Unknown selection mode: {mode}")
+    if abs(q1 - q2) <= 1e-5:
+      return self.undecided_action()
+    return 0 if q1 > q2 else 1
+
+  def undecided_action(self):
+    """Action for ties and unseen states"""
+    if self.default_action is None:
+      return random.randint(0,1)
+    return self.default_action
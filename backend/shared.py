@@ -0,0 +1,47 @@
+"""Exports saved models into flat files that worker processes can memory-map and share.
+
+Run `python shared.py <name>` once to convert saved/<name>.pth and
+saved/<name>.pickle into saved/<name>.shared/. With SHARED_MODELS enabled in
+models.py every worker maps the same files read-only, so the LSTM weights and
+Q-tables live in the page cache once instead of once per worker.
+"""
+import argparse
+import os
+import pickle
+import numpy as np
+from qtable.qtensor import QTensor
+
+
+def shared_path(fname):
+    return f'saved/{fname}.shared'
+
+def export(fname):
+    path = shared_path(fname)
+    import torch
+    state_dict = torch.load(f'saved/{fname}.pth', map_location=torch.device('cpu'))
+    os.makedirs(os.path.join(path, 'lstm'), exist_ok=True)
+    for name, tensor in state_dict.items():
+        np.save(os.path.join(path, 'lstm', f'{name}.npy'), tensor.numpy())
+    with open(f'saved/{fname}.pickle', 'rb') as handle:
+        q_agents = pickle.load(handle)
+    QTensor.from_agents(q_agents).save(os.path.join(path, 'qtable'))
+    return path
+
+def load_state_dict(fname):
+    """LSTM weights backed by copy-on-write mappings of the exported files"""
+    import torch
+    path = os.path.join(shared_path(fname), 'lstm')
+    state_dict = {}
+    for file in sorted(os.listdir(path)):
+        state_dict[file[:-len('.npy')]] = torch.from_numpy(np.load(os.path.join(path, file), mmap_mode='c'))
+    return state_dict
+
+def load_qtensor(fname, default_action=None):
+    return QTensor.load(os.path.join(shared_path(fname), 'qtable'), default_action=default_action)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('name', help='Name of the saved models to export')
+    args = parser.parse_args()
+    print(f"Exported shared models to: {export(args.name)}")
@@ -0,0 +1,34 @@
+"""Request validation of the game endpoints, run from backend/ with `python -m pytest test_app.py`"""
+import os
+import pytest
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+INVALID_MOVES = [[1.0], [0.0], [True], [False], ['1'], [2], [None]]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # app resolves saved/ relative to the working directory
+    monkeypatch.chdir(BACKEND)
+    monkeypatch.syspath_prepend(BACKEND)
+    import app
+    return app.app.test_client()
+
+@pytest.mark.parametrize('moves', INVALID_MOVES)
+def test_play_rejects_non_integer_moves(client, moves):
+    response = client.post('/play', json={'agent_moves': moves, 'user_moves': [0]})
+    assert response.status_code == 400
+    response = client.post('/play', json={'agent_moves': [0], 'user_moves': moves})
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('moves', INVALID_MOVES)
+def test_play_batch_rejects_non_integer_moves(client, moves):
+    histories = [{'agent_moves': [0], 'user_moves': [1]}, {'agent_moves': moves, 'user_moves': [1]}]
+    response = client.post('/play_batch', json={'histories': histories})
+    assert response.status_code == 400
+    assert response.json['message'] == 'invalid agent moves in history 1'
+
+@pytest.mark.parametrize('moves', INVALID_MOVES)
+def test_session_rejects_non_integer_moves(client, moves):
+    response = client.post('/play', json={'session': True, 'agent_moves': moves, 'user_moves': [1]})
+    assert response.status_code == 400
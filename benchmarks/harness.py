@@ -0,0 +1,162 @@
+"""Timing, statistics and baseline comparison shared by the benchmark suites."""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import numpy as np
+
+# Progress bars would dominate the output and add noise to the timings
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+MIN_REPEAT_TIME = 0.05 # Seconds each timed repeat should last at least
+
+
+class Benchmark():
+    """A named function to time.
+
+    setup() runs untimed before every repeat and its return value is passed to
+    fn. Setting number fixes how many calls make up one repeat, otherwise it is
+    calibrated so that a repeat lasts at least MIN_REPEAT_TIME.
+    """
+
+    def __init__(self, name, fn, setup=None, number=None, teardown=None):
+        self.name = name
+        self.fn = fn
+        self.setup = setup
+        self.number = number
+        self.teardown = teardown
+
+
+def seed_all(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].manual_seed(seed)
+
+def _time_repeat(benchmark, number):
+    state = benchmark.setup() if benchmark.setup else None
+    start = time.perf_counter()
+    for _ in range(number):
+        benchmark.fn(state)
+    elapsed = time.perf_counter() - start
+    if benchmark.teardown:
+        benchmark.teardown(state)
+    return elapsed / number
+
+def _calibrate(benchmark):
+    number = 1
+    while True:
+        elapsed = _time_repeat(benchmark, number) * number
+        if elapsed >= MIN_REPEAT_TIME or number >= 1 << 20:
+            return number
+        number *= max(2, int(MIN_REPEAT_TIME / max(elapsed, 1e-9)))
+
+def summarize(times):
+    times = np.asarray(times)
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    iqr = q3 - q1
+    outliers = int(np.sum((times < q1 - 1.5 * iqr) | (times > q3 + 1.5 * iqr)))
+    return {
+        'median': float(median),
+        'mean': float(np.mean(times)),
+        'stdev': float(statistics.stdev(times)) if len(times) > 1 else 0.0,
+        'min': float(np.min(times)),
+        'max': float(np.max(times)),
+        'iqr': float(iqr),
+        'outliers': outliers,
+        'repeats': len(times),
+    }
+
+def measure(benchmark, seed, warmup, repeats):
+    seed_all(seed)
+    number = benchmark.number or _calibrate(benchmark)
+    for _ in range(warmup):
+        _time_repeat(benchmark, number)
+    seed_all(seed)
+    times = [_time_repeat(benchmark, number) for _ in range(repeats)]
+    stats = summarize(times)
+    stats['number'] = number
+    return stats
+
+def environment(seed):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    versions = {'python': platform.python_version(), 'numpy': np.__version__}
+    if 'torch' in sys.modules:
+        versions['torch'] = sys.modules['torch'].__version__
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'seed': seed,
+        'versions': versions,
+    }
+
+def compare(results, baseline, threshold):
+    """Prints the median change of every benchmark and returns the names of regressions.
+
+    A benchmark regresses when its median is slower by more than threshold and
+    the difference is larger than the spread (IQR) of both runs.
+    """
+    regressions = []
+    print(f"Compared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    for name, stats in results.items():
+        if name not in baseline['results']:
+            print(f"\t{name:<40} (new)")
+            continue
+        before = baseline['results'][name]
+        ratio = stats['median'] / before['median']
+        noise = stats['iqr'] + before['iqr']
+        flag = ''
+        if ratio > 1 + threshold and stats['median'] - before['median'] > noise:
+            flag = ' REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold and before['median'] - stats['median'] > noise:
+            flag = ' improved'
+        print(f"\t{name:<40} {format_time(before['median']):>10} -> {format_time(stats['median']):>10} ({(ratio - 1) * 100:+.1f}%){flag}")
+    return regressions
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.2f}{unit}'
+    return f'{seconds / 1e-9:.1f}ns'
+
+def parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-k', '--filter', help='Only run benchmarks whose name contains this string')
+    parser.add_argument('--repeats', type=int, default=10, help='Timed repeats per benchmark')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed repeats before measuring')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='File to write the results to as JSON')
+    parser.add_argument('--compare', help='Results file of a baseline run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown reported as a regression')
+    return parser
+
+def run(benchmarks, args):
+    """Runs the selected benchmarks and handles --out/--compare, returns a process exit code"""
+    results = {}
+    for benchmark in benchmarks:
+        if args.filter and args.filter not in benchmark.name:
+            continue
+        stats = measure(benchmark, args.seed, args.warmup, args.repeats)
+        results[benchmark.name] = stats
+        print(f"{benchmark.name:<40} {format_time(stats['median']):>10} +- {format_time(stats['iqr']):>10} (x{stats['number']}, {stats['repeats']} repeats)")
+
+    report = {'meta': environment(args.seed), 'results': results}
+    if args.out:
+        with open(args.out, 'w') as handle:
+            json.dump(report, handle, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as handle:
+            regressions = compare(results, json.load(handle), args.threshold)
+        return 1 if regressions else 0
+    return 0
@@ -0,0 +1,155 @@
+"""Micro and macro benchmarks for the simulation core.
+
+Run from the repository root:
+
+    python -m benchmarks.simulation --out baseline.json
+    python -m benchmarks.simulation --compare baseline.json
+"""
+from benchmarks.harness import Benchmark, parser, run
+from contextlib import redirect_stdout
+import io
+import json
+import os
+import sys
+import numpy as np
+import params
+
+AGENT_TYPES = [
+    ("Cooperate", [0, 0, 0, 0]),
+    ("Defect", [1, 1, 1, 1]),
+    ("Copy", [0, 1, 0, 1]),
+    ("Grudge", [0, 1, 1, 1]),
+]
+TOURNAMENT_SIZES = [12, 48, 192]
+HISTORY_LENGTHS = [1, 10, 50]
+
+
+def agents_config(count):
+    """Agent configuration with count agents of every memory-1 type, as the file object Agents expects"""
+    config = {'agents': [{'name': name, 'id': i, 'type': 'memory', 'count': count, 'n': 1, 'strategy': strategy}
+                         for i, (name, strategy) in enumerate(AGENT_TYPES)]}
+    return io.StringIO(json.dumps(config))
+
+def quiet(fn):
+    """Runs fn without the configuration printouts of Agents and Game"""
+    with redirect_stdout(io.StringIO()):
+        return fn()
+
+def new_qagent():
+    import qtable.qagent as qag
+    return qag.QAgent(lr=params.QTABLE_LR, discount=params.QTABLE_DISCOUNT, epsilon=params.QTABLE_EPSILON_TRAIN,
+                      decay_rate=params.QTABLE_DECAY_RATE, min_e=params.QTABLE_MIN_EPSILON, memory=params.QTABLE_MEMORY)
+
+def trained_qagent(opponent, epochs=500):
+    import qtable.qlearn as ql
+    q_agent = new_qagent()
+    ql.train(q_agent, opponent, epochs, params.TEST_ROUNDS, params.REWARD)
+    return q_agent
+
+def random_states(count, rounds):
+    lengths = np.random.randint(0, rounds, count)
+    return [np.random.randint(0, 2, (length, 2)) for length in lengths]
+
+def qagent_benchmarks(agents):
+    import qtable.qlearn as ql
+    copy = agents.agents[2]
+    q_agent = trained_qagent(copy)
+    states = random_states(1000, params.TEST_ROUNDS)
+
+    def pick_action(_):
+        for state in states:
+            q_agent.pick_action(state, False)
+
+    def reward_action(_):
+        for prev_state, curr_state in zip(states[:-1], states[1:]):
+            q_agent.pick_action(prev_state, False)
+            q_agent.reward_action(prev_state, curr_state, 0, 2, False)
+
+    return [
+        Benchmark('qagent.pick_action[x1000]', pick_action),
+        Benchmark('qagent.reward_action[x1000]', reward_action),
+        Benchmark('qlearn.play_IPD', lambda q: ql.play_IPD(q, copy, params.TEST_ROUNDS, True, params.REWARD),
+                  setup=new_qagent),
+        Benchmark('qlearn.train[epochs=100]', lambda q: ql.train(q, copy, 100, params.TEST_ROUNDS, params.REWARD),
+                  setup=new_qagent, number=1),
+    ]
+
+def memory_n_benchmarks():
+    from agent.memory_n_agent import MemoryNAgent
+    benchmarks = []
+    for n in (1, 4, 8):
+        strategy = np.random.randint(0, 2, 4**n).tolist()
+        agent = MemoryNAgent('Random', 0, n, strategy)
+        moves = np.random.randint(0, 2, 1000).tolist()
+
+        def update(_, agent=agent, moves=moves):
+            for move in moves:
+                agent.update(move)
+        benchmarks.append(Benchmark(f'memory_n.update[n={n},x1000]', update))
+    return benchmarks
+
+def lstm_benchmarks(agents, device):
+    import torch
+    from lstm.lstm import LSTM
+    from lstm.dataset import PreTrainDataset
+    lstm = LSTM(params.IN, params.LSTM_HIDDEN, params.OUT, len(agents.agents), params.LSTM_LAYERS, params.LSTM_LR, device)
+    lstm.eval()
+    benchmarks = []
+    for length in HISTORY_LENGTHS:
+        input = torch.randint(0, 2, (1, length, params.IN)).float().to(device)
+
+        def predict(_, input=input):
+            with torch.no_grad():
+                lstm.predict_id(input)
+        benchmarks.append(Benchmark(f'lstm.predict_id[len={length}]', predict))
+    benchmarks.append(Benchmark('lstm.PreTrainDataset[sample=256]',
+                                lambda _: PreTrainDataset(agents, params.TEST_ROUNDS, 256), number=1))
+    return benchmarks
+
+def game_benchmarks():
+    from game import Game
+
+    def tournament_setup(count):
+        def setup():
+            game = quiet(lambda: Game(agents_config(count)))
+            game.generations = 10
+            return game
+        return setup
+
+    benchmarks = []
+    for size in TOURNAMENT_SIZES:
+        benchmarks.append(Benchmark(f'game.tournament[pop={size},gens=10]', lambda game: game.tournament(),
+                                    setup=tournament_setup(size // len(AGENT_TYPES)), number=1))
+
+    def animate_setup():
+        game = quiet(lambda: Game(agents_config(12)))
+        generations = [list(np.random.permutation(game.agents.tournament)) for _ in range(50)]
+        return game, generations
+
+    def animate(state):
+        game, generations = state
+        game.animate_tournament(generations, 'benchmark')
+
+    def animate_teardown(_):
+        os.remove('visuals/animations/benchmark_tournament_animation.gif')
+
+    benchmarks.append(Benchmark('game.animate_tournament[pop=48,gens=50]', animate,
+                                setup=animate_setup, number=1, teardown=animate_teardown))
+    return benchmarks
+
+def main(args):
+    # Must happen before game is imported, which copies the params into its namespace
+    params.DEVICE = args.device
+    from agent import agents as ag
+    agents = quiet(lambda: ag.Agents(agents_config(1)))
+    benchmarks = qagent_benchmarks(agents)
+    benchmarks += memory_n_benchmarks()
+    benchmarks += lstm_benchmarks(agents, args.device)
+    benchmarks += game_benchmarks()
+    return run(benchmarks, args)
+
+
+if __name__ == "__main__":
+    parser = parser(__doc__.splitlines()[0])
+    parser.add_argument('--device', default='cpu', help='Device for the LSTM benchmarks')
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,61 @@
+"""Startup time of the entry points.
+
+Every repeat imports the entry point in a fresh interpreter, so nothing is
+cached between repeats. Run from the repository root:
+
+    python -m benchmarks.startup --out startup.json
+    python -m benchmarks.startup --compare startup.json
+"""
+from benchmarks.harness import Benchmark, parser, run
+import subprocess
+import sys
+
+# Slow to import, the entry points only load them on the code paths that use them
+HEAVY_MODULES = ['torch', 'matplotlib', 'imageio', 'PIL']
+# Name, module to import (None for a bare interpreter) and the directory it runs from
+ENTRY_POINTS = [
+    ('python', None, '.'),
+    ('main', 'main', '.'),
+    ('game', 'game', '.'),
+    ('agent.agents', 'agent.agents', '.'),
+    ('qtable.qlearn', 'qtable.qlearn', '.'),
+    ('sweep', 'sweep', '.'),
+    ('backend.app', 'app', 'backend'),
+]
+
+
+def python(code, cwd):
+    return subprocess.run([sys.executable, '-c', code], cwd=cwd, check=True, capture_output=True, text=True).stdout
+
+def heavy_imports(module, cwd):
+    """Heavy modules that importing module loads"""
+    code = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    # Entry points may print while importing, the answer is the last line
+    return python(code, cwd).splitlines()[-1].split()
+
+def check_lazy():
+    """Prints and returns the entry points that import a heavy module at startup"""
+    failures = []
+    for name, module, cwd in ENTRY_POINTS:
+        heavy = heavy_imports(module, cwd) if module else []
+        if heavy:
+            print(f"{name} imports {', '.join(heavy)} at startup")
+            failures.append(name)
+    return failures
+
+def startup_benchmarks():
+    benchmarks = []
+    for name, module, cwd in ENTRY_POINTS:
+        code = f'import {module}' if module else 'pass'
+        benchmarks.append(Benchmark(f'startup.import[{name}]', lambda _, code=code, cwd=cwd: python(code, cwd), number=1))
+    return benchmarks
+
+def main(args):
+    failures = check_lazy()
+    code = run(startup_benchmarks(), args)
+    return 1 if failures else code
+
+
+if __name__ == "__main__":
+    parser = parser(__doc__.splitlines()[0])
+    sys.exit(main(parser.parse_args()))
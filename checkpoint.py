@@ -0,0 +1,58 @@
+"""Training checkpoints that survive interruptions.
+
+A checkpoint is a dict of anything picklable (model and optimizer state,
+epoch counters, Q-tables, ...) saved with the state of every random number
+generator, so that a resumed run continues exactly where the interrupted one
+stopped. Files are replaced atomically, a crash while saving leaves the
+previous checkpoint intact.
+"""
+import os
+import pickle
+import random
+import sys
+import numpy as np
+
+CHECKPOINT_DIR = 'checkpoints'
+
+
+def path(name):
+    return os.path.join(CHECKPOINT_DIR, f'{name}.pickle')
+
+def save(name, state):
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    state = dict(state, rng=rng_state())
+    tmp = f'{path(name)}.tmp'
+    with open(tmp, 'wb') as handle:
+        pickle.dump(state, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path(name))
+
+def load(name):
+    """The checkpoint saved under name with the random number generators restored, or None"""
+    if not os.path.exists(path(name)):
+        return None
+    with open(path(name), 'rb') as handle:
+        state = pickle.load(handle)
+    set_rng_state(state.pop('rng'))
+    return state
+
+def remove(name):
+    if os.path.exists(path(name)):
+        os.remove(path(name))
+
+def rng_state():
+    state = {'random': random.getstate(), 'numpy': np.random.get_state(), 'torch': None, 'cuda': None}
+    # Q-table training never imports torch, so neither does its checkpoint
+    if 'torch' in sys.modules:
+        import torch
+        state['torch'] = torch.get_rng_state()
+        state['cuda'] = torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+    return state
+
+def set_rng_state(state):
+    random.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+    if state['torch'] is not None:
+        import torch
+        torch.set_rng_state(state['torch'])
+        if state['cuda'] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(state['cuda'])
@@ -1,17 +1,24 @@
 from agent import agents as ag
 from tqdm import tqdm
 from params import *
-from lstm.lstm import LSTM
-import matplotlib.pyplot as plt
 import qtable.qagent as qag
 import qtable.qlearn as ql
+from qtable.qtensor import QTensor
+from qtable.scheduler import BudgetScheduler, format_report
+import profiler
+import checkpoint
+from results.store import ResultsWriter
+from render import colormap_palette, frame_scale, save_indexed_gif, upscale
 import numpy as np
-import torch.nn.functional as nnf
-import torch
 import pickle
 import random
+import os
 import math
-import imageio as iio
+import multiprocessing
+import contextlib
+import io
+import params
+from concurrent.futures import ProcessPoolExecutor
 
 CB91_Blue = '#2CBDFE'
 CB91_Green = '#47DBCD'
@@ -21,82 +28,281 @@ CB91_Violet = '#661D98'
 CB91_Amber = '#F5B14C'
 color_list = [CB91_Blue, CB91_Pink, CB91_Green, CB91_Amber,
               CB91_Purple, CB91_Violet]
-plt.rcParams['axes.prop_cycle'] = plt.cycler(color=color_list)
+BACKGROUND_INDEX = 255 # Palette index reserved for white in tournament animations
+
+# torch and matplotlib take seconds to import, so only the code paths that use them import them
+
+def pyplot():
+    """matplotlib.pyplot with the color cycle of the game's plots"""
+    import matplotlib.pyplot as plt
+    plt.rcParams['axes.prop_cycle'] = plt.cycler(color=color_list)
+    return plt
 
 class Game():
     def __init__(self, agents_config):
+        self.agents_file = getattr(agents_config, 'name', None) # Lets worker processes rebuild the agents
         self.agents = ag.Agents(agents_config) # The agents to play against in the tournament
-        self.lstm = LSTM(IN, LSTM_HIDDEN, OUT, len(self.agents.agents), LSTM_LAYERS, LSTM_LR, DEVICE)
+        self._lstm = None
         self.q_agents = {}
         for agent in self.agents.agents:
             self.q_agents[agent.id()] = qag.QAgent(lr = QTABLE_LR, 
                 discount=QTABLE_DISCOUNT, epsilon=QTABLE_EPSILON_TRAIN, 
-                decay_rate=QTABLE_DECAY_RATE, min_e=QTABLE_MIN_EPSILON, memory=QTABLE_MEMORY)
+                decay_rate=QTABLE_DECAY_RATE, min_e=QTABLE_MIN_EPSILON, memory=QTABLE_MEMORY,
+                max_states=QTABLE_MAX_STATES, eviction=QTABLE_EVICTION)
+        self.q_tensor = None
+        self.learner = None
         self.generations = GENERATIONS
         self.interactions = INTERACTIONS
         self.reproduction_rate = REPRODUCTION_RATE
+        self.loaded = None
+
+    @property
+    def lstm(self):
+        """The LSTM, built on first use"""
+        if self._lstm is None:
+            from lstm.lstm import LSTM
+            self._lstm = LSTM(IN, LSTM_HIDDEN, OUT, len(self.agents.agents), LSTM_LAYERS, LSTM_LR, DEVICE)
+        return self._lstm
+
+    @lstm.setter
+    def lstm(self, lstm):
+        self._lstm = lstm
 
-    def train_all(self, visualize=False):
-        self.train_lstm()
-        self.train_qtables(visualize)
+    def train_all(self, visualize=False, checkpoint_name=None, resume=False, workers=1, save_frames=False):
+        self.train_lstm(checkpoint_name, resume, workers)
+        self.train_qtables(visualize, checkpoint_name, resume, save_frames)
 
-    def train_lstm(self):
+    def train_lstm(self, checkpoint_name=None, resume=False, workers=1):
+        """Pretrains the LSTM, checkpointing under checkpoint_name and resuming from the checkpoint if resume.
+
+        With workers > 1 it trains data-parallel over that many CPU processes
+        instead (see lstm/distributed.py), which writes no checkpoints.
+        """
         print("Training LSTM")
-        self.lstm.pretrain(self.agents, LSTM_PRETRAIN_BATCH_SIZE, 
-            LSTM_PRETRAIN_EPOCHS, TEST_ROUNDS, LSTM_PRETRAIN_SAMPLE_SIZE)
+        if workers > 1:
+            with profiler.phase('train_lstm'):
+                self._train_lstm_distributed(workers, resume)
+            return
+        with profiler.phase('train_lstm'):
+            self.lstm.pretrain(self.agents, LSTM_PRETRAIN_BATCH_SIZE, 
+                LSTM_PRETRAIN_EPOCHS, TEST_ROUNDS, LSTM_PRETRAIN_SAMPLE_SIZE,
+                checkpoint_name and f'{checkpoint_name}_lstm', resume)
+
+    def _train_lstm_distributed(self, workers, resume):
+        if self.agents_file is None:
+            raise ValueError("Distributed pretraining needs an agent configuration file")
+        if resume:
+            raise ValueError("Distributed pretraining cannot resume from a checkpoint")
+        from lstm import distributed
+        fname = f'distributed_{os.getpid()}'
+        try:
+            distributed.pretrain(self.agents_file, fname, workers)
+            self.lstm.load(fname)
+        finally:
+            if os.path.exists(f'lstm/models/{fname}.pth'):
+                os.remove(f'lstm/models/{fname}.pth')
 
-    def train_qtables(self, visualize=False):
+    def train_qtables(self, visualize=False, checkpoint_name=None, resume=False, save_frames=False):
+        """Trains a Q-table against every agent, checkpointing under checkpoint_name and resuming from the checkpoint if resume"""
         print("Training QTables")
+        checkpoint_name = checkpoint_name and f'{checkpoint_name}_qtables'
+        state = checkpoint.load(checkpoint_name) if checkpoint_name and resume else None
+        mode = 'budget' if QTABLE_BUDGET_EPOCHS is not None or QTABLE_BUDGET_SECONDS is not None else 'fixed'
+        if state:
+            # The two modes track progress differently, a checkpoint only resumes in the mode that wrote it
+            saved_mode = state.get('mode', 'budget' if 'scheduler' in state else 'fixed')
+            if saved_mode != mode:
+                raise ValueError(f"QTable checkpoint {checkpoint_name} was written by {saved_mode} training, "
+                                 f"it cannot resume {mode} training (QTABLE_BUDGET_EPOCHS/QTABLE_BUDGET_SECONDS)")
+        start, progress = 0, None
+        if state and mode == 'fixed':
+            self.q_agents = state['q_agents']
+            start, progress = state['opponent'], state['progress']
+            if state['opponent_state']:
+                self.agents.agents[start].set_state(state['opponent_state'])
+            print(f"Resuming QTable training at agent {start}, epoch {progress['epoch'] if progress else 0}")
+
+        if mode == 'budget':
+            self._train_qtables_scheduled(visualize, checkpoint_name, state, save_frames)
+            return
+
+        def save(index, progress, opponent_state):
+            checkpoint.save(checkpoint_name, {'mode': 'fixed', 'q_agents': self.q_agents, 'opponent': index,
+                                              'progress': progress, 'opponent_state': opponent_state})
+
+        with profiler.phase('train_qtables'):
+            for index in range(start, len(self.agents.agents)):
+                agent = self.agents.agents[index]
+                on_checkpoint = (lambda progress: save(index, progress, agent.get_state())) if checkpoint_name else None
+                with profiler.phase(f'train_qtable[{agent.name}]'):
+                    ql.train(self.q_agents[agent.id()], agent, QTABLE_TRAIN_EPOCHS, 
+                        TEST_ROUNDS, REWARD, visual=visualize, name=agent.name,
+                        progress=progress, checkpoint=on_checkpoint, checkpoint_every=QTABLE_CHECKPOINT_EVERY,
+                        save_frames=save_frames)
+                progress = None
+                if checkpoint_name:
+                    save(index + 1, None, None)
+        self.q_tensor = QTensor.from_agents(self.q_agents, QTABLE_DEFAULT_ACTION)
+        self._record_qtable_stats()
+
+    def _train_qtables_scheduled(self, visualize, checkpoint_name, state, save_frames=False):
+        """Trains all Q-tables in interleaved chunks, moving budget from converged opponents to the others"""
+        scheduler = BudgetScheduler(QTABLE_BUDGET_EPOCHS, QTABLE_BUDGET_SECONDS, QTABLE_CHUNK_EPOCHS,
+                                    QTABLE_CONVERGENCE_DELTA, QTABLE_CONVERGENCE_CHUNKS)
+        if state:
+            self.q_agents = state['q_agents']
+            for agent, opponent_state in zip(self.agents.agents, state['opponent_states']):
+                agent.set_state(opponent_state)
         for agent in self.agents.agents:
-            ql.train(self.q_agents[agent.id()], agent, QTABLE_TRAIN_EPOCHS, 
-                TEST_ROUNDS, REWARD, visual=visualize, name=agent.name)
+            scheduler.add(agent.name, self.q_agents[agent.id()], agent)
+        if state:
+            scheduler.set_state(state['scheduler'])
+            print(f"Resuming QTable training after {scheduler.epochs} epochs")
+
+        def save():
+            checkpoint.save(checkpoint_name, {'mode': 'budget', 'q_agents': self.q_agents, 'scheduler': scheduler.get_state(),
+                                              'opponent_states': [agent.get_state() for agent in self.agents.agents]})
+
+        with profiler.phase('train_qtables'):
+            report = scheduler.run(TEST_ROUNDS, REWARD, visual=visualize, checkpoint=save if checkpoint_name else None,
+                                   save_frames=save_frames)
+        print("QTable training budget:")
+        print(format_report(report))
+        profiler.record('qtable_budget', report)
+        self.q_tensor = QTensor.from_agents(self.q_agents, QTABLE_DEFAULT_ACTION)
+        self._record_qtable_stats()
 
     def save_all(self, fname):
         self.save_lstm(fname)
         self.save_qtables(fname)
 
+    def clear_checkpoints(self, checkpoint_name):
+        checkpoint.remove(f'{checkpoint_name}_lstm')
+        checkpoint.remove(f'{checkpoint_name}_qtables')
+
     def save_lstm(self, fname):
         print(f"Saving LSTM to file: lstm/models/{fname}.pth")
-        self.lstm.save(fname)
+        with profiler.phase('save'):
+            self.lstm.save(fname)
 
     def save_qtables(self, fname):
         print(f"Saving Qtables to file: qtable/models/{fname}.pickle")
-        with open(f'qtable/models/{fname}.pickle', 'wb') as handle:
+        with profiler.phase('save'), open(f'qtable/models/{fname}.pickle', 'wb') as handle:
             pickle.dump(self.q_agents, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
     def load(self, fname):
         print(f"Loading Models from file: {fname}")
+        with profiler.phase('load'):
+            self.load_lstm(fname)
+            self.load_qtables(fname)
+        self.loaded = fname
+
+    def load_lstm(self, fname):
         self.lstm.load(fname)
+
+    def load_qtables(self, fname):
         with open(f'qtable/models/{fname}.pickle', 'rb') as handle:
             self.q_agents = pickle.load(handle)
+        self.q_tensor = QTensor.from_agents(self.q_agents, QTABLE_DEFAULT_ACTION)
+        self._record_qtable_stats()
+
+    def _record_qtable_stats(self):
+        stats = {agent.name: self.q_agents[agent.id()].stats() for agent in self.agents.agents}
+        profiler.record('qtables', stats)
 
     def visualize_lstm(self, fname):
-        for agent in self.agents.agents:
-            confidence_file = f'lstm/visuals/confidence/{fname}_{agent.name}.png'
-            self.visualize_lstm_confidence(agent, confidence_file)
-        accuracy_file = f'lstm/visuals/accuracy/{fname}.png'
-        self.visualize_lstm_accuracy(accuracy_file)
+        with profiler.phase('visualization'):
+            for agent in self.agents.agents:
+                confidence_file = f'lstm/visuals/confidence/{fname}_{agent.name}.png'
+                self.visualize_lstm_confidence(agent, confidence_file)
+            accuracy_file = f'lstm/visuals/accuracy/{fname}.png'
+            self.visualize_lstm_accuracy(accuracy_file)
 
-    def play(self):
-        print("Playing Game")
-        self.lstm.eval()
-        accuracies = {}
-        for epoch in range(TEST_EPOCHS):
-            print("EPOCH %d" % epoch)
-            errors = 0
-            total_reward = 0
-            for i in tqdm(range(TEST_GAMES)):
-                agent = self.agents.get_random_agent()
-                reward, error = self._play_one_game(agent, TEST_ROUNDS)
-                errors += error
-                total_reward += reward
-                agent.reset()
+    def play(self, workers=1, seed=None, online=False):
+        """Plays TEST_EPOCHS evaluation epochs, in parallel over worker processes if workers > 1.
 
-            frac = (TEST_GAMES-errors)/TEST_GAMES
-            print("Prediction Accuracy: %.2f" % frac)
-            print(f"Total Reward: {total_reward}")
-            print(f"Average Reward per Game: {total_reward/TEST_GAMES}")
-            print(f"Average Reward per Round: {total_reward/(TEST_GAMES*TEST_ROUNDS)}")
+        Every epoch gets its own seed derived from seed, so the results do not
+        depend on the number of workers. With online, the LSTM keeps learning
+        from the finished games in the background (see start_online_learning).
+        """
+        if online and workers > 1:
+            raise ValueError("Online learning needs all games in one process")
+        with profiler.phase('play'):
+            print("Playing Game")
+            seeds = np.random.SeedSequence(seed).generate_state(TEST_EPOCHS).tolist()
+            if workers > 1:
+                results = self._play_parallel(workers, seeds)
+            else:
+                self.lstm.eval()
+                if online:
+                    self.start_online_learning(seed)
+                results = (self._play_epoch(epoch_seed) for epoch_seed in seeds)
+            accuracies = []
+            rewards = []
+            for epoch, (frac, total_reward) in enumerate(results):
+                print("EPOCH %d" % epoch)
+                print("Prediction Accuracy: %.2f" % frac)
+                print(f"Total Reward: {total_reward}")
+                print(f"Average Reward per Game: {total_reward/TEST_GAMES}")
+                print(f"Average Reward per Round: {total_reward/(TEST_GAMES*TEST_ROUNDS)}")
+                accuracies.append(frac)
+                rewards.append(total_reward/TEST_GAMES)
+
+            summary = {'accuracy': _mean_interval(accuracies), 'reward_per_game': _mean_interval(rewards)}
+            print("Over %d epochs (mean +- 95%% CI):" % TEST_EPOCHS)
+            print("Prediction Accuracy: %.3f +- %.3f" % summary['accuracy'])
+            print("Average Reward per Game: %.3f +- %.3f" % summary['reward_per_game'])
+            if online:
+                self.stop_online_learning()
+            return summary
+
+    def start_online_learning(self, seed=None):
+        """Fine-tunes the LSTM on the opponents of finished games in a background thread.
+
+        Games only push their history and the true opponent id into a replay
+        buffer, the learner swaps in new weights every ONLINE_PUBLISH_EVERY steps.
+        """
+        from lstm.online import OnlineLearner, ReplayBuffer
+        buffer = ReplayBuffer(ONLINE_BUFFER_SIZE, seed)
+        self.learner = OnlineLearner(self.lstm, buffer, ONLINE_BATCH_SIZE, ONLINE_LR, ONLINE_PUBLISH_EVERY)
+        self.learner.start()
+
+    def stop_online_learning(self):
+        """Stops the learner and keeps its latest weights as the game's LSTM"""
+        self.learner.stop()
+        print(f"Online learning: {self.learner.steps} steps, {self.learner.version} weight updates, "
+              f"recent loss {np.mean(self.learner.losses) if self.learner.losses else float('nan'):.4f}")
+        self.lstm = self.learner.model
+        self.learner = None
+
+    def _play_epoch(self, seed, progress=True):
+        """Plays TEST_GAMES games against random agents, returns the prediction accuracy and total reward"""
+        import torch
+        random.seed(seed)
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        # Training leaves the agents mid-game, start every epoch from the same state
+        for agent in self.agents.agents:
+            agent.reset()
+        errors = 0
+        total_reward = 0
+        for i in tqdm(range(TEST_GAMES), disable=not progress):
+            agent = self.agents.get_random_agent()
+            reward, error = self._play_one_game(agent, TEST_ROUNDS)
+            errors += error
+            total_reward += reward
+            agent.reset()
+        return (TEST_GAMES-errors)/TEST_GAMES, total_reward
+
+    def _play_parallel(self, workers, seeds):
+        if self.agents_file is None or self.loaded is None:
+            raise ValueError("Parallel play needs an agent configuration file and loaded models")
+        # Workers re-import params, so hand them the values this process runs with
+        settings = {k: v for k, v in vars(params).items() if k.isupper()}
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(self.agents_file, self.loaded, settings)) as executor:
+            yield from executor.map(_play_worker_epoch, seeds)
 
     def _play_one_game(self, agent, rounds):
         """Plays a single game against an agent, comprised of ROUNDS iterations"""
@@ -104,22 +310,26 @@ class Game():
         prev_agent_moves = []
         prev_nn_moves = []
         reward = 0
-        input = self.lstm.build_input_vector(prev_agent_choice)
-        id = self.lstm.build_id_vector(agent)
+        # The online learner may publish new weights at any time, a game sticks to one version
+        lstm = self.learner.model if self.learner else self.lstm
+        input = lstm.build_input_vector(prev_agent_choice)
         # Play ROUNDS iterations of the prisoners dilemma against the same agent
         for _ in range(rounds):
             prev_moves = np.array([prev_nn_moves, prev_agent_moves]).T
-            pred_id, id_logits = self.lstm.predict_id(input)
-            probs = nnf.softmax(id_logits, dim=1).detach().cpu().numpy()
+            pred_id, id_logits = lstm.predict_id(input)
+            probs = id_logits.softmax(dim=1).detach().cpu().numpy()
             agent_action = int(agent.play())
-            # TODO: Implement Linear combination of results here
-            nn_action = self.q_agents[pred_id].pick_action(prev_moves, False)
-            input = self.lstm.rebuild_input(nn_action, agent_action, input[0])
+            nn_action = self.q_tensor.pick_action(probs, prev_moves, QTABLE_SELECTION)
+            input = lstm.rebuild_input(nn_action, agent_action, input[0])
             agent.update(nn_action)
             prev_agent_moves.append(agent_action)
             prev_nn_moves.append(nn_action)
             reward += ql.get_reward(nn_action, agent_action, REWARD)[0]
-        # self.lstm.learn(id_logits, id)
+        if self.learner:
+            self.learner.buffer.push(input[0].detach().cpu(), agent.id())
+        profiler.count('games')
+        profiler.count('rounds', rounds)
+        profiler.count('lstm_forwards', rounds)
 
         return reward, 0 if pred_id == agent.id() else 1
 
@@ -141,6 +351,7 @@ class Game():
 
         x = list(accuracies.keys())
         y = list(accuracies.values())
+        plt = pyplot()
         plt.figure()
         plt.plot(x, y, 'o-')
         plt.ylim([0,1])
@@ -164,13 +375,14 @@ class Game():
             input = self.lstm.rebuild_input(nn_action, agent_action, input[0])
             agent.update(nn_action)
 
-            probs = torch.softmax(id_logits.squeeze().detach().cpu(), dim=0)
+            probs = id_logits.squeeze().detach().cpu().softmax(dim=0)
             confidences.append(probs.numpy())
 
         predicted_id = id_logits.argmax(dim=-1).item()
         print("The Predicted ID is: %d" % predicted_id)
 
         confidences = np.array(confidences)
+        plt = pyplot()
         plt.figure()
         for i in range(confidences.shape[1]):
             plt.plot(confidences[:, i], label = self.agents.agents[i].name)
@@ -201,6 +413,8 @@ class Game():
             rewards[0] += ql.get_reward(agent0_action, agent1_action, reward)[0]
             rewards[1] += ql.get_reward(agent0_action, agent1_action, reward)[1]
 
+        profiler.count('games')
+        profiler.count('rounds', ROUNDS)
         return rewards
     
     def natural_selection(self, agents_pre_selection):
@@ -220,6 +434,7 @@ class Game():
           i += 1
           
         img = img.reshape((side, side)).astype(np.uint8)
+        plt = pyplot()
         plt.figure(figsize=(5,5))
         plt.imshow(img, cmap='gist_ncar', vmin=0, vmax=unique_agents)
         plt.colorbar()
@@ -227,22 +442,38 @@ class Game():
         plt.savefig(filename)
         plt.close()
         
-    def animate_tournament(self, generations, name):
-        frames = []
-        i = 0
-        
+    def animate_tournament(self, generations, name, save_frames=False):
         agent_ids = []
         for agent in generations[0]:
           agent_ids.append(agent.id())
         unique_agents = len(np.unique(agent_ids))
-        
+
+        if save_frames:
+          for i, generation in enumerate(generations):
+            filename = 'visuals/images/{name}_generation_{idx}.png'.format(name=name, idx=i)
+            self.plot_generation(generation, unique_agents, filename)
+
+        # Ids map straight to palette indices, empty cells use the clipped top color like imshow
+        palette = colormap_palette('gist_ncar', 0, unique_agents)
+        palette[BACKGROUND_INDEX] = 255
+        side = int(np.ceil(np.sqrt(len(generations[0]))))
+        scale = frame_scale(side)
+        legend = self._tournament_legend(unique_agents, side * scale, max(1, scale // 2))
+        gap = np.full((side * scale, max(1, scale // 4)), BACKGROUND_INDEX, dtype=np.uint8)
+
+        frames = []
         for generation in generations:
-          filename = 'visuals/images/{name}_generation_{idx}.png'.format(name=name, idx=i)
-          self.plot_generation(generation, unique_agents, filename)
-          frames.append(iio.imread(filename))
-          i += 1
-          
-        iio.mimsave('visuals/animations/{name}_tournament_animation.gif'.format(name=name), frames, fps=6)
+          grid = np.full(side * side, unique_agents + 1, dtype=np.uint8)
+          grid[:len(generation)] = [agent.id() for agent in generation]
+          grid = upscale(grid.reshape((side, side)), scale)
+          frames.append(np.hstack([grid, gap, legend]))
+
+        save_indexed_gif(frames, palette, 'visuals/animations/{name}_tournament_animation.gif'.format(name=name), fps=6)
+
+    def _tournament_legend(self, unique_agents, height, width):
+        """Vertical color strip standing in for the colorbar of plot_generation"""
+        values = np.round(np.linspace(unique_agents, 0, height)).astype(np.uint8)
+        return np.repeat(values[:, np.newaxis], width, axis=1)
 
     def graph_tournament(self, generations, name):
         agent_pops = dict()
@@ -255,6 +486,7 @@ class Game():
             for agent in generation:
                 agent_pops[agent.name][-1] += 1
 
+        plt = pyplot()
         plt.figure(dpi=200)
         for k, v in agent_pops.items():
             plt.plot(np.arange(len(generations)), v, label=k)
@@ -267,9 +499,20 @@ class Game():
         plt.savefig(filename)
         plt.close()
 
-    def tournament(self, visual=False, name='unnamed'):
+    def tournament(self, visual=False, name='unnamed', record=False, record_pairs=False, save_frames=False):
+        with profiler.phase('tournament'):
+            generations = self._tournament(name, record, record_pairs)
+        if visual:
+            with profiler.phase('visualization'):
+                self.animate_tournament(generations, name, save_frames)
+                self.graph_tournament(generations, name)
+
+    def _tournament(self, name, record, record_pairs):
         generations = []
         generations.append(self.agents.tournament)
+        writer = self._results_writer(self.agents.tournament, record_pairs) if record else None
+        if writer:
+            writer.record_population(self.agents.tournament)
         for generation in tqdm(range(self.generations)):
             tournament_agents = self.agents.tournament
             
@@ -284,13 +527,62 @@ class Game():
                     reward0, reward1 = self.play_IPD(agent0, agent1, REWARD)
                     agents_and_rewards[i][1] += reward0
                     agents_and_rewards[i+1][1] += reward1
+                    if writer:
+                        writer.record_game(generation, interaction, agent0, agent1, reward0, reward1)
                     
+            if writer:
+                writer.record_rewards(agents_and_rewards)
             agents_and_rewards.sort(key=lambda x: x[1])
             agents_pre_selection = [list(a_r) for a_r in zip(*agents_and_rewards)][0]
             
             agents_post_selection = self.natural_selection(agents_pre_selection)
             generations.append(agents_post_selection)
             self.agents.tournament = agents_post_selection
-        if visual:
-            self.animate_tournament(generations, name)
-            self.graph_tournament(generations, name)
\ No newline at end of file
+            if writer:
+                writer.record_population(agents_post_selection)
+        if record:
+            path = writer.save(name, metadata={
+                'generations': self.generations,
+                'interactions': self.interactions,
+                'rounds': ROUNDS,
+                'reproduction_rate': self.reproduction_rate,
+                'reward': REWARD,
+            })
+            print(f"Saved tournament results to: {path}")
+        return generations
+
+    def _results_writer(self, tournament_agents, record_pairs):
+        type_ids = []
+        type_names = []
+        for agent in tournament_agents:
+            if agent.id() not in type_ids:
+                type_ids.append(agent.id())
+                type_names.append(agent.name)
+        return ResultsWriter(type_ids, type_names, record_pairs)
+
+
+_worker_game = None
+
+def _init_worker(agents_file, fname, settings):
+    """Builds the game and loads the models once per worker process"""
+    global _worker_game
+    import torch
+    # Workers share the machine, one thread each avoids oversubscribing the cores
+    torch.set_num_threads(1)
+    # Spawned workers import this module before the initializer runs, so update both namespaces
+    vars(params).update(settings)
+    globals().update(settings)
+    with contextlib.redirect_stdout(io.StringIO()), open(agents_file, 'r') as handle:
+        _worker_game = Game(handle)
+        _worker_game.load(fname)
+    _worker_game.lstm.eval()
+
+def _play_worker_epoch(seed):
+    return _worker_game._play_epoch(seed, progress=False)
+
+def _mean_interval(values):
+    """Mean and half-width of its 95% confidence interval (normal approximation)"""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 2:
+        return float(values.mean()), float('nan')
+    return float(values.mean()), float(1.96 * values.std(ddof=1) / np.sqrt(len(values)))
@@ -6,8 +6,10 @@ from torch.utils.data import Dataset, DataLoader
 
 class PreTrainDataset(Dataset):
 
-  def __init__(self, agents, rounds, sample_size):
-    self.generate_data(agents, rounds, sample_size)
+  # shard=(rank, world_size) keeps only this rank's share of the movesets, the
+  # ranks must sample with the same random state so that their shards are disjoint
+  def __init__(self, agents, rounds, sample_size, shard=None):
+    self.generate_data(agents, rounds, sample_size, shard)
 
   def __getitem__(self, idx):
     item = self.data[idx]
@@ -21,9 +23,14 @@ class PreTrainDataset(Dataset):
         "output" : agent_id
     }
 
-  def generate_data(self, agents, rounds, sample_size):
+  def generate_data(self, agents, rounds, sample_size, shard=None):
       d = np.array([seq for seq in itertools.product([0,1], repeat=rounds)])
       movesets = random.sample(list(d), sample_size)
+      if shard:
+          # Equal shards, so every rank runs the same number of batches
+          rank, world_size = shard
+          per_rank = sample_size // world_size
+          movesets = movesets[rank * per_rank:(rank + 1) * per_rank]
       self.data = []
 
       for agent in agents.agents:
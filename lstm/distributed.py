@@ -0,0 +1,96 @@
+"""Data-parallel LSTM pretraining on the CPU cores of one machine.
+
+Every process generates and trains on its own shard of the pretraining games,
+and DistributedDataParallel averages the gradients of every batch over the
+processes (gloo backend), so all replicas keep the same weights. The processes
+find each other through a temporary file and talk over the loopback interface,
+no GPU or network is needed. Rank 0 saves the weights through LSTM.save, they
+load like those of a single-process run.
+
+    python -m lstm.distributed -a <path_to_agent_config> -s <save_filename> -j <workers>
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+import params
+from .dataset import PreTrainDataset
+from .lstm import LSTM, _initialize_weights
+
+
+def pretrain(agents_file, fname, workers, seed=None, settings=None):
+    """Pretrains an LSTM in workers processes and saves it to lstm/models/<fname>.pth.
+
+    settings overrides params.py in the workers and defaults to the values of
+    this process, since spawned workers import params afresh.
+    """
+    if settings is None:
+        settings = {k: v for k, v in vars(params).items() if k.isupper()}
+    if seed is None:
+        seed = random.randrange(2**32)
+    os.environ.setdefault('GLOO_SOCKET_IFNAME', 'lo0' if sys.platform == 'darwin' else 'lo')
+    with tempfile.TemporaryDirectory() as directory:
+        init_method = 'file://' + os.path.join(directory, 'rendezvous')
+        mp.spawn(_worker, args=(workers, init_method, agents_file, fname, seed, settings), nprocs=workers)
+
+def _worker(rank, world_size, init_method, agents_file, fname, seed, settings):
+    vars(params).update(settings)
+    # Share the cores between the processes instead of oversubscribing them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    dist.init_process_group('gloo', init_method=init_method, rank=rank, world_size=world_size)
+    try:
+        # Only rank 0 reports progress
+        output = contextlib.nullcontext() if rank == 0 else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            _train(rank, world_size, agents_file, fname, seed)
+    finally:
+        dist.destroy_process_group()
+
+def _train(rank, world_size, agents_file, fname, seed):
+    from agent import agents as ag
+    with open(agents_file, 'r') as handle:
+        agents = ag.Agents(handle)
+    torch.manual_seed(seed)
+    model = LSTM(params.IN, params.LSTM_HIDDEN, params.OUT, len(agents.agents), params.LSTM_LAYERS, params.LSTM_LR, 'cpu')
+    model.apply(_initialize_weights)
+    replica = DistributedDataParallel(model)
+    model.train()
+
+    # Every rank draws the same movesets, the shards split them between the ranks
+    random.seed(seed)
+    np.random.seed(seed)
+    dataset = PreTrainDataset(agents, params.TEST_ROUNDS, params.LSTM_PRETRAIN_SAMPLE_SIZE, shard=(rank, world_size))
+    # The per-rank batches add up to the batch size of a single-process run
+    dataloader = DataLoader(dataset, batch_size=max(1, params.LSTM_PRETRAIN_BATCH_SIZE // world_size))
+
+    for epoch in range(params.LSTM_PRETRAIN_EPOCHS):
+        epoch_accs = []
+        for batch in tqdm(dataloader, disable=rank != 0):
+            model._train_batch(batch, epoch_accs, replica)
+        accuracy = torch.tensor(np.mean(epoch_accs))
+        dist.all_reduce(accuracy)
+        print(accuracy.item() / world_size)
+
+    if rank == 0:
+        print(f"Saving LSTM to file: lstm/models/{fname}.pth")
+        model.save(fname)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pretrains the LSTM data-parallel over several CPU processes')
+    parser.add_argument('-a', '--agents', help='Filename to load agent configuration from.', required=True, type=str)
+    parser.add_argument('-s', '--save', help='Filename to save LSTM after training', required=True, type=str)
+    parser.add_argument('-j', '--jobs', help='Number of training processes', default=os.cpu_count(), type=int)
+    parser.add_argument('--seed', help='Seed for the weights and the generated games', type=int)
+    args = parser.parse_args()
+    pretrain(args.agents, args.save, args.jobs, args.seed)
@@ -5,6 +5,8 @@ from .dataset import PreTrainDataset
 import numpy as np
 from torch.utils.data import DataLoader
 from tqdm import tqdm
+import profiler
+import checkpoint
 
 
 class LSTM(nn.Module):
@@ -13,6 +15,9 @@ class LSTM(nn.Module):
         self.lstm = nn.LSTM(in_dim, hidden_dim, layer_num, batch_first=True)
         self.relu = nn.ReLU()
         self.id_fc = nn.Linear(hidden_dim, id_dim)
+        # The default DEVICE is 'cuda', machines without a GPU run on the CPU instead
+        if str(device).startswith('cuda') and not torch.cuda.is_available():
+            device = 'cpu'
         self.device = device
         self.to(device)
         self.optimizer = optim.Adam(self.parameters(), lr=lr)
@@ -24,17 +29,32 @@ class LSTM(nn.Module):
         out = self.id_fc(out)
         return out
 
-    def pretrain(self, agents, batch_size, epochs, rounds, sample_size):
+    def pretrain(self, agents, batch_size, epochs, rounds, sample_size, checkpoint_name=None, resume=False):
+        """Trains on generated games, with checkpoint_name saving a checkpoint after every epoch that resume continues from"""
         self.train()
-        self.apply(_initialize_weights)
-        dataset = PreTrainDataset(agents, rounds, sample_size)
+        state = checkpoint.load(checkpoint_name) if checkpoint_name and resume else None
+        if state:
+            self.load_state_dict(state['model'])
+            self.optimizer.load_state_dict(state['optimizer'])
+            dataset = state['dataset']
+            start = state['epoch']
+            print(f"Resuming LSTM training after epoch {start}")
+        else:
+            self.apply(_initialize_weights)
+            with profiler.phase('dataset'):
+                dataset = PreTrainDataset(agents, rounds, sample_size)
+            start = 0
         dataloader = DataLoader(dataset, batch_size = batch_size)
 
-        for epoch in range(epochs):
+        for epoch in range(start, epochs):
             epoch_accs = []
             for batch in tqdm(dataloader):
                 self._train_batch(batch, epoch_accs)
+                profiler.count('lstm_batches')
             print(np.mean(epoch_accs))
+            if checkpoint_name:
+                checkpoint.save(checkpoint_name, {'model': self.state_dict(), 'optimizer': self.optimizer.state_dict(),
+                                                  'dataset': dataset, 'epoch': epoch + 1})
 
     def predict_id(self, input):
         """Predicts the ID of an agent based on the input"""
@@ -72,14 +92,14 @@ class LSTM(nn.Module):
         torch.save(self.state_dict(), f"lstm/models/{fname}.pth")
 
     def load(self, fname):
-        self.load_state_dict(torch.load(f"lstm/models/{fname}.pth"))
+        self.load_state_dict(torch.load(f"lstm/models/{fname}.pth", map_location=self.device))
         self.to(self.device)
     
-    def _train_batch(self, batch, epoch_accs):
-        """Pretrains weights based on a batch of inputs"""
+    def _train_batch(self, batch, epoch_accs, model=None):
+        """Pretrains weights based on a batch of inputs, run through model (e.g. a DistributedDataParallel wrapper) if given"""
         input = batch["input"].type(torch.FloatTensor).to(self.device)
         output = batch["output"].to(self.device)
-        pred = self(input)
+        pred = (model or self)(input)
         pred_logits = pred[:, -1, :]
         loss = self.criterion(pred_logits, output)
         self.optimizer.zero_grad()
@@ -0,0 +1,101 @@
+import copy
+import random
+import threading
+from collections import deque
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+
+class ReplayBuffer():
+    """Bounded, thread-safe store of (history, true id) examples from finished games"""
+
+    def __init__(self, capacity, seed=None):
+        self.examples = deque(maxlen=capacity)
+        # The learner samples from another thread, the global random state belongs to the games
+        self.random = random.Random(seed)
+        self.added = 0 # Total examples pushed, including ones that were pushed out again
+        self.condition = threading.Condition()
+
+    def push(self, history, id):
+        with self.condition:
+            self.examples.append((history, id))
+            self.added += 1
+            self.condition.notify()
+
+    def wait(self, added, timeout):
+        """Blocks until added examples have been pushed in total (or timeout), returns the total"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.added >= added, timeout)
+            return self.added
+
+    def sample(self, batch_size):
+        with self.condition:
+            indices = self.random.sample(range(len(self.examples)), min(batch_size, len(self.examples)))
+            return [self.examples[i] for i in indices]
+
+    def __len__(self):
+        return len(self.examples)
+
+
+class OnlineLearner(threading.Thread):
+    """Fine-tunes a copy of an LSTM in the background on examples from a ReplayBuffer.
+
+    Games keep reading self.model, which is only ever replaced as a whole by a
+    fresh copy of the trained weights, so inference never waits for training
+    and never sees half updated weights.
+    """
+
+    def __init__(self, model, buffer, batch_size, lr, publish_every):
+        super().__init__(daemon=True, name='online-learner')
+        self.model = model
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.publish_every = publish_every
+        self.trainer = copy.deepcopy(model)
+        self.trainer.train()
+        self.optimizer = optim.Adam(self.trainer.parameters(), lr=lr)
+        self.steps = 0
+        self.version = 0
+        self.losses = deque(maxlen=100)
+        self.stopped = threading.Event()
+
+    def run(self):
+        added = 0
+        while not self.stopped.is_set():
+            # One optimizer step per batch_size new examples, so idle games do not overfit old data
+            total = self.buffer.wait(added + self.batch_size, timeout=0.1)
+            if total < added + self.batch_size:
+                continue
+            added = total
+            self.step(self.buffer.sample(self.batch_size))
+            if self.steps % self.publish_every == 0:
+                self.publish()
+
+    def step(self, examples):
+        histories = [history for history, _ in examples]
+        lengths = torch.tensor([len(history) for history in histories])
+        # Right padding leaves the outputs up to the last real round of every history unchanged
+        input = nn.utils.rnn.pad_sequence(histories, batch_first=True).to(self.trainer.device)
+        ids = torch.tensor([id for _, id in examples]).to(self.trainer.device)
+        out = self.trainer(input)
+        id_logits = out[torch.arange(len(examples)), lengths - 1]
+        loss = self.trainer.criterion(id_logits, ids)
+        self.optimizer.zero_grad()
+        loss.backward()
+        self.optimizer.step()
+        self.steps += 1
+        self.losses.append(loss.item())
+
+    def publish(self):
+        model = copy.deepcopy(self.trainer)
+        model.eval()
+        self.model = model
+        self.version += 1
+
+    def stop(self):
+        """Stops training and publishes the latest weights"""
+        self.stopped.set()
+        self.join()
+        if self.steps > 0 and self.steps % self.publish_every != 0:
+            self.publish()
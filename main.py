@@ -1,4 +1,5 @@
 import argparse
+import profiler
 from game import Game
 
 
@@ -7,24 +8,28 @@ MODELS_HELP = 'Models to train (qtable, lstm, or all).'
 MODEL_CHOICES = ['qtable', 'lstm', 'all']
 
 def main(args):
-	game = Game(args['agents'])
+	with profiler.phase('setup'):
+		game = Game(args['agents'])
 	if args['train']:
+		# Checkpoints are named after the save file, --resume continues an interrupted run
 		if args['models'] == 'qtable':
-			game.train_qtables(args['visualize'])
+			game.train_qtables(args['visualize'], args['save'], args['resume'], args['frames'])
 			game.save_qtables(args['save'])    
 		elif args['models'] == 'lstm':
-			game.train_lstm()
+			game.train_lstm(args['save'], args['resume'], args['jobs'])
 			game.save_lstm(args['save'])
 		else:
-			game.train_all(args['visualize'])
+			game.train_all(args['visualize'], args['save'], args['resume'], args['jobs'], args['frames'])
 			game.save_all(args['save'])
+		game.clear_checkpoints(args['save'])
 	elif args['tournament']:
-		game.tournament(visual=args['visualize'], name=args['name'])
+		game.tournament(visual=args['visualize'], name=args.get('name', 'unnamed'),
+			record=args['record'], record_pairs=args['pairs'], save_frames=args['frames'])
 	else:
 		game.load(args['load'])
 		if args['visualize']:
 			game.visualize_lstm(args['load'])
-		game.play()
+		game.play(workers=args['jobs'], seed=args['seed'], online=args['online'])
 
 
 if __name__ == "__main__":
@@ -33,17 +38,34 @@ if __name__ == "__main__":
 	parser.add_argument('-t', '--train', help='Flag to train LSTM', action='store_true')
 	parser.add_argument('-r', '--tournament', help='Runs a Tournament', action='store_true')
 	parser.add_argument('-v', '--visualize', help='Enables Visualizations', action='store_true')
+	parser.add_argument('-o', '--record', help='Saves tournament results to a columnar store', action='store_true')
+	parser.add_argument('-p', '--profile', help='Writes a JSON report of time spent per phase to this file', type=str)
+	parser.add_argument('--profile-memory', help='Also tracks peak memory per phase (slower)', action='store_true')
+	parser.add_argument('--profile-sample', help='Also samples the call stack every this many seconds', type=float)
 	opts, rem_args = parser.parse_known_args()
 	if opts.train:
 		parser.add_argument('-s', '--save', help='Filename to save LSTM after training', required=True, type=str)
 		parser.add_argument('-m', '--models', help=MODELS_HELP, default='all', 
 			const='all', nargs='?', choices=MODEL_CHOICES)
+		parser.add_argument('--resume', help='Continues training from the last checkpoint', action='store_true')
+		parser.add_argument('-j', '--jobs', help='Number of CPU processes to pretrain the LSTM in', default=1, type=int)
+		parser.add_argument('--frames', help='With -v, also saves a PNG for every Q-table snapshot', action='store_true')
 	elif opts.tournament:
-		if opts.visualize:
-			parser.add_argument('-n', '--name', help="Filename to save tournament visualizations", required=True, type=str)
+		parser.add_argument('--pairs', help='Also records per-pair game outcomes', action='store_true')
+		parser.add_argument('--frames', help='Also saves a PNG for every generation', action='store_true')
+		if opts.visualize or opts.record:
+			parser.add_argument('-n', '--name', help="Filename to save tournament visualizations and results", required=True, type=str)
 	else:
 		parser.add_argument('-l', '--load', help='Filename to load LSTM', required=True, type=str)
+		parser.add_argument('-j', '--jobs', help='Number of processes to play evaluation epochs in', default=1, type=int)
+		parser.add_argument('--seed', help='Seed for the evaluation games', type=int)
+		parser.add_argument('--online', help='Keeps training the LSTM on the evaluation games', action='store_true')
 	args = vars(parser.parse_args())
 
-	main(args)
+	if args['profile']:
+		profiler.PROFILER.enable(memory=args['profile_memory'], sample_interval=args['profile_sample'])
+	try:
+		main(args)
+	finally:
+		profiler.PROFILER.report(args['profile'])
 
@@ -6,6 +6,12 @@ LSTM_PRETRAIN_BATCH_SIZE = 32
 LSTM_PRETRAIN_SAMPLE_SIZE = 1024
 
 QTABLE_TRAIN_EPOCHS = 10000
+QTABLE_CHECKPOINT_EVERY = 1000 # Training epochs against one opponent between checkpoints
+QTABLE_BUDGET_EPOCHS = None  # Total training epochs shared by all opponents, None trains QTABLE_TRAIN_EPOCHS against each
+QTABLE_BUDGET_SECONDS = None # Total training time shared by all opponents, None for no time limit
+QTABLE_CHUNK_EPOCHS = 100    # Epochs against one opponent before moving on to the next when training on a budget
+QTABLE_CONVERGENCE_DELTA = 1e-3 # An opponent has converged once no Q-value changes more than this over a chunk...
+QTABLE_CONVERGENCE_CHUNKS = 3   # ...and no greedy action changes, for this many chunks in a row
 QTABLE_TEST_EPOCHS = 1000
 QTABLE_LR = 1            # Higher value means more aggressive learning [0, 1]
 QTABLE_DISCOUNT = 1      # Higher value means trust more in Q-Table [0, 1]
@@ -14,6 +20,10 @@ QTABLE_EPSILON_TEST = 0  # Higher value means more random [0, 1]
 QTABLE_MIN_EPSILON = 0   # Bounds how low epsilon can decay [0, 1]
 QTABLE_DECAY_RATE = 1    # Lower value means faster decay [0, 1]
 QTABLE_MEMORY = 1000     # Number of past moves remembered in any given state [0, INF]
+QTABLE_MAX_STATES = None # Largest number of states per Q-Table before rarely used ones are evicted [1, INF], None for no limit
+QTABLE_EVICTION = 'lfu'  # Which states to evict first, least frequently ('lfu') or least recently ('lru') used
+QTABLE_DEFAULT_ACTION = 0 # Action of trained Q-Tables for ties and unseen states, None picks randomly
+QTABLE_SELECTION = 'weighted' # Blend the Q-tables by predicted agent probability ('weighted') or use the most likely one ('argmax')
 
 DEVICE = 'cuda'
 IN = 2
@@ -23,6 +33,11 @@ REWARD = [[2, 2], # Coop, Coop
           [3, 0], # Dfct, Coop
           [1, 1]] # Dfct, Dfct
 
+ONLINE_BUFFER_SIZE = 10000 # Most recent games kept for online LSTM fine-tuning
+ONLINE_BATCH_SIZE = 32     # New games per online optimizer step
+ONLINE_LR = 1e-5
+ONLINE_PUBLISH_EVERY = 10  # Optimizer steps between weight updates seen by the games
+
 TEST_GAMES = 200
 TEST_ROUNDS = 10
 TEST_EPOCHS = 20
@@ -0,0 +1,155 @@
+"""Opt-in profiling of main.py runs.
+
+Code marks its phases with `with profiler.phase(name):` and counts work with
+profiler.count(name, n). Both are no-ops until enable() is called, so the
+hooks can stay in the hot paths. The report records wall time and (with
+memory tracking) peak traced memory per phase, the counters, the process
+peak RSS and, optionally, a sampling profile of the main thread.
+"""
+import json
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+
+class Profiler():
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.sampler = None
+        self.phases = []
+        self.stack = []
+        self.counters = Counter()
+        self.values = {}
+        self.start = None
+
+    def enable(self, memory=False, sample_interval=None):
+        self.enabled = True
+        self.memory = memory
+        self.start = time.perf_counter()
+        if memory:
+            tracemalloc.start()
+        if sample_interval:
+            self.sampler = Sampler(threading.main_thread().ident, sample_interval)
+            self.sampler.start()
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        self._collect_peak()
+        frame = {'name': name, 'path': '/'.join([f['name'] for f in self.stack] + [name]), 'peak': 0}
+        self.stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._collect_peak()
+            self.stack.pop()
+            record = {'name': name, 'path': frame['path'], 'start': start - self.start, 'seconds': seconds}
+            if self.memory:
+                record['peak_mb'] = frame['peak'] / 2**20
+            self.phases.append(record)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def record(self, name, value):
+        """Stores a value such as a table size, later calls overwrite earlier ones"""
+        if self.enabled:
+            self.values[name] = value
+
+    def _collect_peak(self):
+        # tracemalloc only has one peak, so fold it into every open phase and start over
+        if not self.memory:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in self.stack:
+            frame['peak'] = max(frame['peak'], peak)
+        tracemalloc.reset_peak()
+
+    def totals(self):
+        """Total seconds per phase name, counting nested phases of the same name once"""
+        totals = {}
+        for phase in self.phases:
+            if phase['name'] not in phase['path'].split('/')[:-1]:
+                totals[phase['name']] = totals.get(phase['name'], 0) + phase['seconds']
+        return totals
+
+    def report(self, path):
+        if not self.enabled:
+            return
+        if self.sampler:
+            self.sampler.stop()
+        report = {
+            'argv': sys.argv,
+            'wall_seconds': time.perf_counter() - self.start,
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'totals': self.totals(),
+            'phases': sorted(self.phases, key=lambda phase: phase['start']),
+            'counters': dict(self.counters),
+            'values': self.values,
+        }
+        if self.memory:
+            report['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        if self.sampler:
+            report['samples'] = self.sampler.summary()
+        with open(path, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Profile written to: {path}")
+        for name, seconds in sorted(report['totals'].items(), key=lambda item: -item[1]):
+            print(f"\t{name:<30} {seconds:10.3f}s")
+
+
+class Sampler(threading.Thread):
+    """Periodically records the call stack of one thread"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True, name='profiler-sampler')
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.functions = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.samples += 1
+            self.functions[stack[0]] += 1
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def summary(self, top=30):
+        return {
+            'interval': self.interval,
+            'count': self.samples,
+            'top_functions': self.functions.most_common(top),
+            # Collapsed stacks in the format used by flame graph tools
+            'stacks': dict(self.stacks),
+        }
+
+
+PROFILER = Profiler()
+phase = PROFILER.phase
+count = PROFILER.count
+record = PROFILER.record
@@ -1,16 +1,40 @@
 import random
 import math
+import heapq
+from types import MappingProxyType
+
+EVICTION_POLICIES = ['lfu', 'lru']
+EVICTION_BATCH = 0.1 # Fraction of max_states evicted at once when the table is full
 
 class QAgent:
 
-  def __init__(self, lr, discount, epsilon=1, decay_rate=0.99, min_e=0.1, memory=1000):
+  def __init__(self, lr, discount, epsilon=1, decay_rate=0.99, min_e=0.1, memory=1000, max_states=None, eviction='lfu'):
+    if eviction not in EVICTION_POLICIES:
+      raise ValueError(f"Unknown eviction policy: {eviction}")
     self.Q = {}
+    self.N = {} # Visit counts of every (state, action) pair
+    self.last_seen = {} # Step at which a state was last used, only kept for LRU eviction
+    self.steps = 0
+    self.evictions = 0
     self.epsilon = epsilon
     self.lr = lr
     self.discount = discount
     self.decay_rate = decay_rate
     self.min_e = min_e
     self.memory = memory
+    self.max_states = max_states
+    self.eviction = eviction
+
+  def __setstate__(self, state):
+    # Tables pickled before visit counts existed
+    self.__dict__.update(state)
+    if 'N' not in state:
+      self.N = {k: [0, 0] for k in self.Q}
+      self.last_seen = {}
+      self.steps = 0
+      self.evictions = 0
+      self.max_states = None
+      self.eviction = 'lfu'
 
   def get_q(self, state):
     state = str(state)
@@ -42,7 +66,8 @@ class QAgent:
 
     state = str(state)
     if state not in self.Q:
-      self.Q[state] = [0, 0]
+      self._insert(state)
+    self._touch(state)
 
     self.epsilon = max(self.epsilon * self.decay_rate, self.min_e)
 
@@ -67,13 +92,93 @@ class QAgent:
     prev_state = str(prev_state)
     curr_state = str(curr_state)
 
+    if prev_state not in self.Q:
+      self._insert(prev_state, protected=(curr_state,))
+
     future_potential = 0
     if not is_final_round:
       if curr_state not in self.Q:
-        self.Q[curr_state] = [0, 0]
+        self._insert(curr_state, protected=(prev_state,))
       future_potential = self.discount * max(self.Q[curr_state])
 
     self.Q[prev_state][action] = self.Q[prev_state][action] + self.lr * (reward + future_potential - self.Q[prev_state][action])
+    self.N[prev_state][action] += 1
+
+  def get_table(self):
+    return self.Q
+
+  def freeze(self, default_action=0):
+    return FrozenQAgent(self, default_action)
+
+  def get_visits(self, state):
+    return self.N.get(str(state), [0, 0])
+
+  def stats(self):
+    return {
+      'states': len(self.Q),
+      'max_states': self.max_states,
+      'occupancy': len(self.Q) / self.max_states if self.max_states else None,
+      'evictions': self.evictions,
+      'visits': sum(n0 + n1 for n0, n1 in self.N.values()),
+    }
+
+  def _insert(self, state, protected=()):
+    self.Q[state] = [0, 0]
+    self.N[state] = [0, 0]
+    if self.max_states and len(self.Q) > self.max_states:
+      self._evict(protected + (state,))
+
+  def _touch(self, state):
+    if self.eviction == 'lru':
+      self.steps += 1
+      self.last_seen[state] = self.steps
+
+  def _evict(self, protected):
+    """Removes the least frequently (or recently) used states in one batch so eviction is rare"""
+    count = max(1, int(self.max_states * EVICTION_BATCH))
+    candidates = (k for k in self.Q if k not in protected)
+    if self.eviction == 'lru':
+      victims = heapq.nsmallest(count, candidates, key=lambda k: self.last_seen.get(k, 0))
+    else:
+      # Ties go to the oldest states since the dict keeps insertion order
+      victims = heapq.nsmallest(count, candidates, key=lambda k: self.N[k][0] + self.N[k][1])
+    for k in victims:
+      del self.Q[k]
+      del self.N[k]
+      self.last_seen.pop(k, None)
+    self.evictions += len(victims)
+
+
+class FrozenQAgent:
+  """Greedy, read-only policy of a trained QAgent.
+
+  Unlike QAgent.pick_action, picking an action never inserts states or decays
+  epsilon, so a frozen agent can be shared between threads without locks.
+  Ties and unseen states get default_action.
+  """
+
+  def __init__(self, q_agent, default_action=0):
+    self.Q = MappingProxyType({state: tuple(q) for state, q in q_agent.get_table().items()})
+    self.memory = q_agent.memory
+    self.default_action = default_action
+
+  def __getstate__(self):
+    return {**self.__dict__, 'Q': dict(self.Q)}
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.Q = MappingProxyType(state['Q'])
+
+  def get_q(self, state):
+    return self.Q.get(str(state), (0, 0))
+
+  def pick_action(self, state, is_curious=False):
+    if len(state) > self.memory:
+      state = state[-self.memory:, :]
+    q = self.Q.get(str(state))
+    if q is None or math.isclose(q[0], q[1], abs_tol=1e-5):
+      return self.default_action
+    return 0 if q[0] > q[1] else 1
 
   def get_table(self):
     return self.Q
@@ -1,9 +1,8 @@
 from tqdm import tqdm 
 import numpy as np
-import matplotlib.pyplot as plt
-import math
 import copy
-import imageio as iio
+import profiler
+from render import colormap_palette, frame_scale, save_indexed_gif, upscale
 
 def play_IPD(player_1, player_2, rounds, is_training, reward):
     player_1_actions = []
@@ -57,62 +56,77 @@ def get_reward(action_1, action_2, reward):
     return reward_1, reward_2
 
 def sigmoid(x, stretch):
-  return 1 / (1 + math.exp(-x/stretch))
+  with np.errstate(over='ignore'):
+    return 1 / (1 + np.exp(-np.asarray(x) / stretch))
+
+def qtable_pixels(diffs, side):
+  """Maps Q(defect) - Q(cooperate) for every state to bwr colormap indices on a side x side grid"""
+  img = np.full(side*side, 127.5)
+  img[:len(diffs)] = 127.5 + 255 * (sigmoid(diffs, 3) - 0.5)
+  return img.reshape((side, side)).astype(np.uint8)
 
 def plot_qtable(qtable, filename):
-  qvals = qtable.values()
-  side = int(np.ceil(np.sqrt(len(qvals))))
-  img = np.full((side*side, 1), 127.5)
-  i = 0
-  
-  for k in sorted(qtable, key=len):
-    img[i] = 127.5 + 255 * (sigmoid(qtable.get(k)[1] - qtable.get(k)[0], 3) - 0.5)
-    i += 1
-    
-  img = img.reshape((side, side)).astype(np.uint8)
+  import matplotlib.pyplot as plt
+  side = int(np.ceil(np.sqrt(len(qtable))))
+  diffs = [qtable[k][1] - qtable[k][0] for k in sorted(qtable, key=len)]
+  img = qtable_pixels(diffs, side)
   plt.figure(figsize=(5,5))
   plt.imshow(img, cmap='bwr', vmin=0, vmax=255)
   plt.axis('off')
   plt.savefig(filename)
   plt.close()
   
-def animate_qtable(player, qtables, name):
-  qtable_final = player.get_table()    
-  qtable_snapshot = dict.fromkeys(qtable_final, [0,0])
+def animate_qtable(player, qtables, name, save_frames=False):
+  # The state ordering and grid layout are fixed by the final table, so compute them once
+  states = sorted(player.get_table(), key=len)
+  index = {state: i for i, state in enumerate(states)}
+  side = int(np.ceil(np.sqrt(len(states))))
+  scale = frame_scale(side)
+  palette = colormap_palette('bwr', 0, 255)
+  diffs = np.zeros(len(states))
   frames = []
-  i = 0
 
-  for qtable in qtables:
-    filename = 'qtable/visuals/images/{name}_qtable_{idx}.png'.format(name=name, idx=i)
-    qtable_snapshot.update(qtable)
-    plot_qtable(qtable_snapshot, filename)
-    frames.append(iio.imread(filename))
-    i += 1
+  for i, qtable in enumerate(qtables):
+    # States evicted before the end of training have no place in the final layout
+    kept = [k for k in qtable if k in index]
+    if len(kept) > 0:
+      rows = np.fromiter((index[k] for k in kept), dtype=np.int64, count=len(kept))
+      values = np.array([qtable[k] for k in kept], dtype=np.float64)
+      diffs[rows] = values[:, 1] - values[:, 0]
+    frames.append(upscale(qtable_pixels(diffs, side), scale))
+    if save_frames:
+      snapshot = {state: [0, diffs[j]] for j, state in enumerate(states)}
+      plot_qtable(snapshot, 'qtable/visuals/images/{name}_qtable_{idx}.png'.format(name=name, idx=i))
 
-  iio.mimsave('qtable/visuals/animations/{name}_qtable_animation.gif'.format(name=name), frames, fps=12)
+  save_indexed_gif(frames, palette, 'qtable/visuals/animations/{name}_qtable_animation.gif'.format(name=name), fps=12)
 
 # TRAINING
 # TODO: initial state of (0,0) may bias towards whatever the first selected move is in that state (FIXED: by adding is_curious parameter)
 # TODO: similar payoffs may bias towards defection since cooperation only makes sense after a few moves (FIXED: by setting MAX learning rate)
 # TODO: Q-Table debug "initial state" problem (FIXED: by playing with state logic)
-# TODO: fix player memory, state rewards are currently overflowing
+# TODO: fix player memory, state rewards are currently overflowing (PARTLY FIXED: table size is bounded when max_states / QTABLE_MAX_STATES is set, unbounded by default)
 # TODO: consider filling the table backwards for efficiency, later rounds before earlier rounds
 # TODO: solve problem of players knowing the game length with a probability for ending instead
-# TODO: store number of times a state,action pair has been seen to improve learning, curiosity
+# TODO: use the visit counts (QAgent.N) to improve learning, curiosity
 # TODO: use numba here to speed up training
 
-def train(player_1, player_2, epochs, rounds, reward, verbose=False, visual=False, name='unnamed', granularity=100, early_convergence=False, convergence_epochs=2000):
-  max_total_reward_1 = 0
-  qtables = []
-  qtable_prev = dict()
+def train(player_1, player_2, epochs, rounds, reward, verbose=False, visual=False, name='unnamed', granularity=100, early_convergence=False, convergence_epochs=2000,
+          progress=None, checkpoint=None, checkpoint_every=1000, save_frames=False):
+  # progress is the loop state passed to checkpoint every checkpoint_every epochs, passing it back in resumes training
+  progress = progress or {'epoch': 0, 'max_total_reward_1': 0, 'qtables': [], 'qtable_prev': dict(), 'consecutive_repeats': 0}
+  max_total_reward_1 = progress['max_total_reward_1']
+  qtables = progress['qtables']
+  qtable_prev = progress['qtable_prev']
   qtable_curr = dict()
-  consecutive_repeats = 0
+  consecutive_repeats = progress['consecutive_repeats']
 
-  for i in tqdm(range(epochs)):
+  for i in tqdm(range(progress['epoch'], epochs)):
     total_reward_1, total_reward_2, moveset = play_IPD(player_1, player_2, rounds, True, reward) 
+    profiler.count('qtable_games')
+    profiler.count('qtable_rounds', rounds)
     max_total_reward_1 = max(total_reward_1, max_total_reward_1)
     
-    if (i % granularity == 0):
+    if visual and (i % granularity == 0):
       qtable_curr = copy.deepcopy(player_1.get_table())
       qtables.append(qtable_curr)
     if early_convergence:
@@ -127,12 +141,18 @@ def train(player_1, player_2, epochs, rounds, reward, verbose=False, visual=Fals
             consecutive_repeats = 0
 
         qtable_prev = copy.deepcopy(qtable_curr)
+
+    if checkpoint and (i + 1) % checkpoint_every == 0:
+      checkpoint({'epoch': i + 1, 'max_total_reward_1': max_total_reward_1, 'qtables': qtables,
+                  'qtable_prev': qtable_prev, 'consecutive_repeats': consecutive_repeats})
       
   if verbose:
     print('Player 1 Max Training Reward Seen:', max_total_reward_1)
+    print('Player 1 Q-Table:', player_1.stats())
     
   if visual:
-    animate_qtable(player_1, qtables, name)
+    with profiler.phase('visualization'):
+      animate_qtable(player_1, qtables, name, save_frames)
      
     
 
@@ -145,9 +165,11 @@ def test(player_1, player_2, epochs, rounds, epsilon, memory, reward, verbose=Fa
   total_rewards_2 = []
   movesets = []
   player_1.set_epsilon(epsilon)
+  # Without exploration the policy is greedy, so test a frozen copy that leaves the table untouched
+  policy = player_1.freeze() if epsilon <= 0 else player_1
 
   for i in tqdm(range(epochs)):
-    total_reward_1, total_reward_2, moveset = play_IPD(player_1, player_2, rounds, False, reward)    
+    total_reward_1, total_reward_2, moveset = play_IPD(policy, player_2, rounds, False, reward)    
 
     if total_reward_1 > total_reward_2:
       Q_wins += 1
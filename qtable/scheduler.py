@@ -0,0 +1,157 @@
+import copy
+import time
+import profiler
+import qtable.qlearn as ql
+
+
+class Task:
+  """Training state of the Q-table against one opponent"""
+
+  def __init__(self, name, player, opponent):
+    self.name = name
+    self.player = player
+    self.opponent = opponent
+    self.epochs = 0
+    self.seconds = 0
+    self.chunks = 0
+    self.stable_chunks = 0  # Consecutive chunks without a significant change
+    self.converged_at = None
+    self.max_delta = None
+    self.policy_changes = None
+    self.snapshots = []
+
+  def converged(self):
+    return self.converged_at is not None
+
+
+class BudgetScheduler:
+  """Trains Q-tables against several opponents in interleaved chunks under one shared budget.
+
+  After every chunk the table is compared with the one before it, an opponent
+  has converged once no Q-value moved more than tol and no greedy action changed
+  for patience chunks in a row. Converged opponents stop training and the rest
+  of the budget goes to the ones that are still learning. The budget is a total
+  number of epochs, a number of seconds, or both (whichever runs out first).
+  """
+
+  def __init__(self, budget_epochs=None, budget_seconds=None, chunk=100, tol=1e-3, patience=3):
+    if budget_epochs is None and budget_seconds is None:
+      raise ValueError("BudgetScheduler needs an epoch or a time budget")
+    self.budget_epochs = budget_epochs
+    self.budget_seconds = budget_seconds
+    self.chunk = chunk
+    self.tol = tol
+    self.patience = patience
+    self.tasks = []
+    self.epochs = 0
+    self.seconds = 0
+
+  def add(self, name, player, opponent):
+    self.tasks.append(Task(name, player, opponent))
+
+  def exhausted(self):
+    return ((self.budget_epochs is not None and self.epochs >= self.budget_epochs) or
+            (self.budget_seconds is not None and self.seconds >= self.budget_seconds))
+
+  def run(self, rounds, reward, visual=False, granularity=100, checkpoint=None, save_frames=False):
+    """Trains round-robin until every opponent converged or the budget is spent, checkpoint() is called after every round"""
+    while not self.exhausted():
+      active = [task for task in self.tasks if not task.converged()]
+      if not active:
+        break
+      for task in active:
+        if self.exhausted():
+          break
+        epochs = self.chunk
+        if self.budget_epochs is not None:
+          epochs = min(epochs, self.budget_epochs - self.epochs)
+        self.train_chunk(task, epochs, rounds, reward, visual, granularity)
+      if checkpoint:
+        checkpoint()
+
+    if visual:
+      with profiler.phase('visualization'):
+        for task in self.tasks:
+          task.snapshots.append(copy.deepcopy(task.player.get_table()))
+          ql.animate_qtable(task.player, task.snapshots, task.name, save_frames)
+    return self.report()
+
+  def train_chunk(self, task, epochs, rounds, reward, visual, granularity):
+    before = {state: tuple(q) for state, q in task.player.get_table().items()}
+    start = time.perf_counter()
+    with profiler.phase(f'train_qtable[{task.name}]'):
+      for _ in range(epochs):
+        if visual and task.epochs % granularity == 0:
+          task.snapshots.append(copy.deepcopy(task.player.get_table()))
+        ql.play_IPD(task.player, task.opponent, rounds, True, reward)
+        task.epochs += 1
+    profiler.count('qtable_games', epochs)
+    profiler.count('qtable_rounds', epochs * rounds)
+    seconds = time.perf_counter() - start
+    task.seconds += seconds
+    task.chunks += 1
+    self.epochs += epochs
+    self.seconds += seconds
+
+    task.max_delta, task.policy_changes = table_change(before, task.player.get_table())
+    if task.max_delta <= self.tol and task.policy_changes == 0:
+      task.stable_chunks += 1
+      if task.stable_chunks >= self.patience:
+        task.converged_at = task.epochs
+    else:
+      task.stable_chunks = 0
+
+  def report(self):
+    """Budget spent on every opponent and whether it converged"""
+    return {task.name: {
+      'epochs': task.epochs,
+      'seconds': task.seconds,
+      'share': task.epochs / self.epochs if self.epochs else 0,
+      'converged': task.converged(),
+      'max_delta': task.max_delta,
+      'policy_changes': task.policy_changes,
+    } for task in self.tasks}
+
+  def get_state(self):
+    """Progress of every opponent, without the tables and agents themselves"""
+    return {
+      'epochs': self.epochs,
+      'seconds': self.seconds,
+      'tasks': [{k: v for k, v in task.__dict__.items() if k not in ('player', 'opponent')} for task in self.tasks],
+    }
+
+  def set_state(self, state):
+    """Restores the progress only, the budget and convergence settings stay those of the constructor so that a resumed run can extend them"""
+    for task, task_state in zip(self.tasks, state['tasks']):
+      task.__dict__.update(task_state)
+    self.epochs = state['epochs']
+    self.seconds = state['seconds']
+
+
+def greedy_action(q):
+  if q[0] == q[1]:
+    return None
+  return 0 if q[0] > q[1] else 1
+
+def table_change(before, after):
+  """Largest change of any Q-value and number of states whose greedy action changed, new states count from zero"""
+  max_delta = 0
+  policy_changes = 0
+  for state, q in after.items():
+    old = before.get(state, (0, 0))
+    max_delta = max(max_delta, abs(q[0] - old[0]), abs(q[1] - old[1]))
+    if greedy_action(q) != greedy_action(old):
+      policy_changes += 1
+  return max_delta, policy_changes
+
+def format_report(report):
+  lines = []
+  for name, spent in report.items():
+    if spent['converged']:
+      status = 'converged'
+    elif spent['max_delta'] is None:
+      status = 'not trained'
+    else:
+      status = f"max delta {spent['max_delta']:.3g}, {spent['policy_changes']} policy changes"
+    lines.append(f"\t{name}: {spent['epochs']} epochs ({spent['share']:.0%}), {spent['seconds']:.1f}s, {status}")
+  return '\n'.join(lines)
@@ -0,0 +1,51 @@
+import io
+import numpy as np
+
+FRAME_SIZE = 400 # Approximate width and height of rendered frames in pixels
+
+
+def colormap_palette(cmap, vmin, vmax, size=256):
+    """Precomputes an RGB palette mapping integer values to colors of cmap, clipped to [vmin, vmax] like imshow"""
+    import matplotlib
+    values = np.clip(np.arange(size), vmin, vmax)
+    colors = matplotlib.colormaps[cmap]((values - vmin) / (vmax - vmin))
+    return np.round(colors[:, :3] * 255).astype(np.uint8)
+
+
+def frame_scale(side):
+    """Integer upscaling factor that brings a side x side grid close to FRAME_SIZE"""
+    return max(1, FRAME_SIZE // max(side, 1))
+
+
+def upscale(grid, scale):
+    """Nearest neighbour upscaling of a 2D index grid"""
+    return np.repeat(np.repeat(grid, scale, axis=0), scale, axis=1)
+
+
+def encode_indexed_gif(frames, palette, fps):
+    """Encodes 2D uint8 palette index frames into an in-memory GIF"""
+    from PIL import Image
+    palette = palette.astype(np.uint8).tobytes()
+    images = []
+    for frame in frames:
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        height, width = frame.shape
+        image = Image.frombytes('P', (width, height), frame.tobytes())
+        image.putpalette(palette)
+        images.append(image)
+    buffer = io.BytesIO()
+    images[0].save(buffer,
+                   format='GIF',
+                   save_all=True,
+                   append_images=images[1:],
+                   optimize=False,
+                   loop=0,
+                   duration=int(1000 / fps))
+    return buffer
+
+
+def save_indexed_gif(frames, palette, filename, fps):
+    """Encodes palette index frames in memory and writes the GIF to disk once"""
+    buffer = encode_indexed_gif(frames, palette, fps)
+    with open(filename, 'wb') as handle:
+        handle.write(buffer.getbuffer())
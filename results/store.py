@@ -0,0 +1,150 @@
+import json
+import os
+import numpy as np
+
+RESULTS_DIR = 'results/runs'
+PAIR_COLUMNS = ['generation', 'interaction', 'type0', 'type1', 'reward0', 'reward1']
+
+
+class ResultsWriter():
+    """Collects tournament outcomes per generation and writes them as columnar NumPy arrays.
+
+    Every column is stored in its own .npy file so that readers can memory-map
+    exactly the columns a query needs.
+    """
+
+    def __init__(self, type_ids, type_names, record_pairs=False):
+        self.type_ids = list(type_ids)
+        self.type_names = list(type_names)
+        self.columns = {type_id: col for col, type_id in enumerate(self.type_ids)}
+        self.record_pairs = record_pairs
+        self.population = []
+        self.rewards = []
+        self.pairs = {column: [] for column in PAIR_COLUMNS}
+
+    def record_population(self, agents):
+        """Appends the number of agents of each type in a generation"""
+        counts = np.zeros(len(self.type_ids), dtype=np.int32)
+        for agent in agents:
+            counts[self.columns[agent.id()]] += 1
+        self.population.append(counts)
+
+    def record_rewards(self, agents_and_rewards):
+        """Appends the total reward earned by each type in a generation"""
+        totals = np.zeros(len(self.type_ids), dtype=np.int64)
+        for agent, reward in agents_and_rewards:
+            totals[self.columns[agent.id()]] += reward
+        self.rewards.append(totals)
+
+    def record_game(self, generation, interaction, agent0, agent1, reward0, reward1):
+        """Appends the outcome of a single game (only kept if record_pairs is set)"""
+        if not self.record_pairs:
+            return
+        row = [generation, interaction, self.columns[agent0.id()], self.columns[agent1.id()], reward0, reward1]
+        for column, value in zip(PAIR_COLUMNS, row):
+            self.pairs[column].append(value)
+
+    def save(self, name, metadata=None, directory=RESULTS_DIR):
+        path = os.path.join(directory, name)
+        os.makedirs(path, exist_ok=True)
+        num_types = len(self.type_ids)
+        np.save(os.path.join(path, 'type_ids.npy'), np.array(self.type_ids, dtype=np.int32))
+        np.save(os.path.join(path, 'population.npy'), np.array(self.population, dtype=np.int32).reshape(-1, num_types))
+        np.save(os.path.join(path, 'rewards.npy'), np.array(self.rewards, dtype=np.int64).reshape(-1, num_types))
+        if self.record_pairs:
+            os.makedirs(os.path.join(path, 'pairs'), exist_ok=True)
+            for column in PAIR_COLUMNS:
+                np.save(os.path.join(path, 'pairs', f'{column}.npy'), np.array(self.pairs[column], dtype=np.int32))
+        meta = {
+            'type_names': self.type_names,
+            'pairs': self.record_pairs,
+        }
+        meta.update(metadata or {})
+        with open(os.path.join(path, 'meta.json'), 'w') as handle:
+            json.dump(meta, handle, indent=2)
+        return path
+
+
+class TournamentResults():
+    """Read-only view over a saved tournament. Columns are memory-mapped on first use."""
+
+    def __init__(self, name, directory=RESULTS_DIR):
+        self.path = os.path.join(directory, name)
+        with open(os.path.join(self.path, 'meta.json'), 'r') as handle:
+            self.meta = json.load(handle)
+        self.type_names = self.meta['type_names']
+        self.type_ids = self._column('type_ids')
+        self._columns = {}
+
+    def _column(self, column):
+        return np.load(os.path.join(self.path, f'{column}.npy'), mmap_mode='r')
+
+    def _cached(self, column):
+        if column not in self._columns:
+            self._columns[column] = self._column(column)
+        return self._columns[column]
+
+    def type_index(self, agent_type):
+        """Resolves an agent type given by name or by id to its column index"""
+        if isinstance(agent_type, str):
+            if agent_type not in self.type_names:
+                raise KeyError(f'unknown agent type: {agent_type}')
+            return self.type_names.index(agent_type)
+        matches = np.flatnonzero(self.type_ids == agent_type)
+        if len(matches) == 0:
+            raise KeyError(f'unknown agent id: {agent_type}')
+        return int(matches[0])
+
+    @property
+    def generations(self):
+        """Number of simulated generations (the population has one more row for the initial state)"""
+        return len(self._cached('rewards'))
+
+    def population(self, agent_type=None):
+        """Population per generation, either for one type or as a (generations+1, types) array"""
+        population = self._cached('population')
+        if agent_type is None:
+            return population
+        return population[:, self.type_index(agent_type)]
+
+    def population_share(self, agent_type=None):
+        population = np.asarray(self.population(), dtype=np.float64)
+        share = population / population.sum(axis=1, keepdims=True)
+        if agent_type is None:
+            return share
+        return share[:, self.type_index(agent_type)]
+
+    def rewards(self, agent_type=None):
+        """Total reward per generation, either for one type or as a (generations, types) array"""
+        rewards = self._cached('rewards')
+        if agent_type is None:
+            return rewards
+        return rewards[:, self.type_index(agent_type)]
+
+    def mean_reward(self, agent_type=None):
+        """Average reward earned by a single agent of each type per generation"""
+        population = np.asarray(self.population()[:-1], dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(population > 0, self.rewards() / population, np.nan)
+        if agent_type is None:
+            return mean
+        return mean[:, self.type_index(agent_type)]
+
+    def has_pairs(self):
+        return self.meta['pairs']
+
+    def pairs(self, column):
+        if not self.has_pairs():
+            raise ValueError('per-pair outcomes were not recorded for this tournament')
+        return self._cached(os.path.join('pairs', column))
+
+    def reward_distribution(self, agent_type, generation=None):
+        """Per-game rewards earned by a type, optionally restricted to one generation"""
+        col = self.type_index(agent_type)
+        mask0 = self.pairs('type0') == col
+        mask1 = self.pairs('type1') == col
+        if generation is not None:
+            in_generation = self.pairs('generation') == generation
+            mask0 &= in_generation
+            mask1 &= in_generation
+        return np.concatenate([self.pairs('reward0')[mask0], self.pairs('reward1')[mask1]])
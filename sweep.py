@@ -0,0 +1,197 @@
+"""Hyperparameter sweeps over the settings in params.py.
+
+A spec file names the agent configuration and the values to try for any
+params.py setting, either every combination ("grid") or a number of random
+draws ("random"):
+
+    {
+      "agents": "agent/config/default.json",
+      "search": "random",
+      "trials": 20,
+      "seed": 0,
+      "fixed": {"TEST_EPOCHS": 5},
+      "params": {
+        "QTABLE_DISCOUNT": [0.5, 0.9, 1],
+        "LSTM_HIDDEN": {"int": [50, 300]},
+        "LSTM_LR": {"log_uniform": [1e-5, 1e-3]}
+      }
+    }
+
+Every trial runs in a fresh worker process with its overrides applied before
+the game is imported, trains (or reuses) the models and plays the evaluation
+epochs. Trained models are cached by the settings they depend on, so trials
+that only differ in Q-table settings share one LSTM and the other way round.
+
+    python sweep.py sweep.json -j 8
+"""
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import params
+
+SWEEPS_DIR = 'results/sweeps'
+# Settings that change the trained models, all others only affect evaluation
+LSTM_PARAMS = ['IN', 'OUT', 'LSTM_HIDDEN', 'LSTM_LAYERS', 'LSTM_LR', 'LSTM_PRETRAIN_EPOCHS',
+               'LSTM_PRETRAIN_BATCH_SIZE', 'LSTM_PRETRAIN_SAMPLE_SIZE', 'TEST_ROUNDS']
+QTABLE_PARAMS = ['QTABLE_TRAIN_EPOCHS', 'QTABLE_LR', 'QTABLE_DISCOUNT', 'QTABLE_EPSILON_TRAIN', 'QTABLE_MIN_EPSILON',
+                 'QTABLE_DECAY_RATE', 'QTABLE_MEMORY', 'QTABLE_MAX_STATES', 'QTABLE_EVICTION', 'QTABLE_BUDGET_EPOCHS',
+                 'QTABLE_BUDGET_SECONDS', 'QTABLE_CHUNK_EPOCHS', 'QTABLE_CONVERGENCE_DELTA', 'QTABLE_CONVERGENCE_CHUNKS',
+                 'TEST_ROUNDS', 'REWARD']
+
+
+def sample(rng, values):
+    """A value from a list, or from {"uniform": [low, high]}, {"log_uniform": [low, high]} or {"int": [low, high]}"""
+    if isinstance(values, list):
+        return rng.choice(values)
+    (kind, (low, high)), = values.items()
+    if kind == 'uniform':
+        return rng.uniform(low, high)
+    elif kind == 'log_uniform':
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+    elif kind == 'int':
+        return rng.randint(low, high)
+    raise ValueError(f"Unknown distribution: {kind}")
+
+def trials(spec):
+    """Parameter overrides of every trial in the spec"""
+    space = spec['params']
+    fixed = spec.get('fixed', {})
+    unknown = [name for name in list(space) + list(fixed) if not name.isupper() or not hasattr(params, name)]
+    if unknown:
+        raise ValueError(f"Not settings in params.py: {', '.join(unknown)}")
+    if spec.get('search', 'grid') == 'grid':
+        if not all(isinstance(values, list) for values in space.values()):
+            raise ValueError("A grid search needs a list of values for every setting")
+        combinations = [dict(zip(space, values)) for values in itertools.product(*space.values())]
+    elif spec['search'] == 'random':
+        rng = random.Random(spec.get('seed', 0))
+        combinations = [{name: sample(rng, values) for name, values in space.items()} for _ in range(spec['trials'])]
+    else:
+        raise ValueError(f"Unknown search: {spec['search']}")
+    return [{**fixed, **combination} for combination in combinations]
+
+def cache_key(config, seed, names):
+    settings = {name: getattr(params, name) for name in names}
+    text = json.dumps([config, seed, settings], sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+def seed_all(seed):
+    import torch
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+def save_atomic(save, fname, path):
+    """Saves under a temporary name first, so concurrent trials never load a half written model"""
+    tmp = f'{fname}.tmp{os.getpid()}'
+    save(tmp)
+    os.replace(path.format(tmp), path.format(fname))
+
+def run_trial(overrides, agents_file, seed):
+    """Trains and evaluates one setting, in a process of its own"""
+    os.environ.setdefault('TQDM_DISABLE', '1')
+    # Game copies the settings when it is imported, so override them first
+    vars(params).update(overrides)
+    from game import Game
+    with open(agents_file, 'r') as handle:
+        config = handle.read()
+    result = {'lstm_cached': False, 'qtables_cached': False}
+    start = time.perf_counter()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output), open(agents_file, 'r') as handle:
+        game = Game(handle)
+        # Seeding every stage makes results independent of which models came from the cache
+        lstm_name = 'sweep_lstm_' + cache_key(config, seed, LSTM_PARAMS)
+        if os.path.exists(f'lstm/models/{lstm_name}.pth'):
+            game.load_lstm(lstm_name)
+            result['lstm_cached'] = True
+        else:
+            seed_all(seed)
+            stage = time.perf_counter()
+            game.train_lstm()
+            result['train_lstm_seconds'] = time.perf_counter() - stage
+            save_atomic(game.save_lstm, lstm_name, 'lstm/models/{}.pth')
+
+        qtable_name = 'sweep_qtable_' + cache_key(config, seed, QTABLE_PARAMS)
+        if os.path.exists(f'qtable/models/{qtable_name}.pickle'):
+            game.load_qtables(qtable_name)
+            result['qtables_cached'] = True
+        else:
+            seed_all(seed)
+            stage = time.perf_counter()
+            game.train_qtables()
+            result['train_qtables_seconds'] = time.perf_counter() - stage
+            save_atomic(game.save_qtables, qtable_name, 'qtable/models/{}.pickle')
+
+        stage = time.perf_counter()
+        summary = game.play(seed=seed)
+        result['play_seconds'] = time.perf_counter() - stage
+    result['accuracy'], result['accuracy_ci'] = summary['accuracy']
+    result['reward_per_game'], result['reward_per_game_ci'] = summary['reward_per_game']
+    result['wall_seconds'] = time.perf_counter() - start
+    return result
+
+def run(spec, workers):
+    settings = trials(spec)
+    seed = spec.get('seed', 0)
+    results = [None] * len(settings)
+    # One process per trial, so no settings or imported modules leak from one trial into the next
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, max_tasks_per_child=1) as executor:
+        futures = {executor.submit(run_trial, overrides, spec['agents'], seed): i for i, overrides in enumerate(settings)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'error': repr(e)}
+            results[i] = {'trial': i, 'params': settings[i], **result}
+            print(f"Trial {i + 1}/{len(settings)}: {format_result(results[i])}")
+    return results
+
+def format_result(result):
+    if 'error' in result:
+        return f"{result['params']} failed: {result['error']}"
+    return (f"{result['params']} accuracy {result['accuracy']:.3f} +- {result['accuracy_ci']:.3f}, "
+            f"reward {result['reward_per_game']:.2f} +- {result['reward_per_game_ci']:.2f} ({result['wall_seconds']:.1f}s)")
+
+def save(results, name):
+    """Writes the results table as JSON and as CSV with one column per setting"""
+    os.makedirs(SWEEPS_DIR, exist_ok=True)
+    path = os.path.join(SWEEPS_DIR, name)
+    with open(f'{path}.json', 'w') as handle:
+        json.dump(results, handle, indent=2)
+    names = list(dict.fromkeys(name for result in results for name in result['params']))
+    columns = list(dict.fromkeys(k for result in results for k in result if k not in ('trial', 'params')))
+    with open(f'{path}.csv', 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['trial'] + names + columns)
+        for result in results:
+            writer.writerow([result['trial']] + [result['params'].get(n) for n in names] + [result.get(c) for c in columns])
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Runs a hyperparameter sweep over params.py settings')
+    parser.add_argument('spec', help='JSON file describing the sweep', type=argparse.FileType('r'))
+    parser.add_argument('-j', '--jobs', help='Number of trials to run in parallel', default=os.cpu_count(), type=int)
+    parser.add_argument('-n', '--name', help=f'Name of the results in {SWEEPS_DIR} (default: name of the spec)', type=str)
+    args = parser.parse_args()
+
+    results = run(json.load(args.spec), args.jobs)
+    path = save(results, args.name or os.path.splitext(os.path.basename(args.spec.name))[0])
+    print(f"Saved sweep results to: {path}.csv")
+    ranked = sorted((r for r in results if 'error' not in r), key=lambda r: -r['accuracy'])
+    for result in ranked[:5]:
+        print(f"\t{format_result(result)}")